@@ -0,0 +1,175 @@
+# This program exports the spectra of single pixels within the masked regions of spectral cubes,
+# e.g. to train pixel classifiers. It uses the 'folder_list.txt' file (the first three lines are skipped),
+# takes 'Corrected_' folders when they exist and reads the masks (masks1.jpg, masks2.jpg ...) from <folder>/masks.
+#
+# At most MAX_PIXELS_PER_MASK pixels are taken at random from every mask, so that large masks do not outweigh
+# small ones. The mask is divided into SPATIAL_STRATA x SPATIAL_STRATA blocks and every block gives its share
+# of the pixels (stratified sampling), so the pixels are spread over the whole masked region.
+#
+# The pixels are written to the OUTPUT_FOLDER in shards of at most SHARD_ROWS rows:
+#   'npy'     -- <folder>_<n>.npy (uint8 array, pixels x bands) and <folder>_<n>_labels.csv (folder, mask, y, x)
+#   'parquet' -- <folder>_<n>.parquet with the columns folder, mask, y, x, b365 ... b1000 (needs pyarrow)
+# The wavelengths of the columns are saved to 'wavelengths.csv', and the list of shards to 'manifest.csv'
+# (only the files listed there belong to the last run).
+# Every band image is decoded once per folder and written straight into the shards on disk,
+# so the memory needed does not depend on the number or size of the cubes. Folders are processed in parallel.
+
+import csv
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from Mask_spectra import list_masks, resize_mask_to_image
+from spectral_cube import read_folder_list, resolve_corrected_folder, list_spectral_images, load_grayscale, image_size
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# ----------------- CONFIG -----------------
+OUTPUT_FOLDER = "Pixel_export"
+FORMAT = "auto"  # 'npy', 'parquet' or 'auto' (parquet if pyarrow is installed)
+MAX_PIXELS_PER_MASK = 2000  # None takes every pixel
+SPATIAL_STRATA = 4  # the mask is sampled in 4 x 4 blocks; 1 samples the mask as a whole
+SHARD_ROWS = 100_000  # pixels per output file
+SEED = 0  # the same seed gives the same pixels
+WORKERS = os.cpu_count()  # folders processed in parallel
+
+# Wavelength list: 365, then 400..1000 step 5
+WAVELENGTHS = [365] + list(range(400, 1001, 5))
+
+
+# ----------------- HELPERS -----------------
+def output_format() -> str:
+    if FORMAT == "auto":
+        return "npy" if pa is None else "parquet"
+    if FORMAT == "parquet" and pa is None:
+        raise ImportError("FORMAT = 'parquet' needs the pyarrow package (pip install pyarrow)")
+    return FORMAT
+
+
+def sample_pixels(mask01: np.ndarray, cap: int | None, strata: int, rng: np.random.Generator) -> np.ndarray:
+    """Flat positions of at most cap pixels of the mask, shared among strata x strata blocks by their area."""
+    idx = np.flatnonzero(mask01)
+    if cap is None or idx.size <= cap:
+        return idx
+
+    H, W = mask01.shape
+    ys, xs = np.divmod(idx, W)
+    block = (ys * strata // H) * strata + (xs * strata // W)
+    counts = np.bincount(block, minlength=strata * strata)
+
+    # Largest remainder allocation of the cap to the blocks
+    share = counts * cap / idx.size
+    quota = np.floor(share).astype(int)
+    rest = cap - quota.sum()
+    quota[np.argsort(share - quota)[::-1][:rest]] += 1
+
+    chosen = []
+    for b in np.flatnonzero(quota):
+        chosen.append(rng.choice(idx[block == b], size=quota[b], replace=False))
+    return np.sort(np.concatenate(chosen))
+
+
+def export_folder(folder: Path) -> list[dict]:
+    """Sample and write the pixels of one folder; returns the manifest rows of its shards."""
+    folder_path = resolve_corrected_folder(folder)
+    mask_files = list_masks(folder_path)
+    if not mask_files:
+        return []
+
+    band_files = dict(list_spectral_images(folder_path))
+    missing = [wl for wl in WAVELENGTHS if wl not in band_files]
+    if missing:
+        print(f"{folder}: bands {missing} nm not found, folder skipped")
+        return []
+
+    H, W = image_size(folder_path)
+    rng = np.random.default_rng([SEED, *folder.name.encode()])
+
+    # Pixels to export, mask by mask
+    positions = []
+    labels = []
+    for mask_file in mask_files:
+        idx = sample_pixels(resize_mask_to_image(load_grayscale(mask_file), H, W), MAX_PIXELS_PER_MASK,
+                            SPATIAL_STRATA, rng)
+        positions.append(idx)
+        labels.extend([mask_file.name] * idx.size)
+    positions = np.concatenate(positions)
+    if positions.size == 0:
+        return []
+
+    # One array file on disk per shard, filled band by band
+    starts = list(range(0, positions.size, SHARD_ROWS))
+    base_names = [f"{folder.name}_{n:03d}" for n in range(len(starts))]
+    tmp_paths = [Path(OUTPUT_FOLDER) / f"{name}.tmp.npy" for name in base_names]
+    shards = [np.lib.format.open_memmap(path, mode="w+", dtype=np.uint8,
+                                        shape=(min(SHARD_ROWS, positions.size - start), len(WAVELENGTHS)))
+              for path, start in zip(tmp_paths, starts)]
+    for j, wl in enumerate(WAVELENGTHS):
+        values = load_grayscale(band_files[wl]).ravel()[positions]
+        for shard, start in zip(shards, starts):
+            shard[:, j] = values[start:start + len(shard)]
+    for shard in shards:
+        shard.flush()
+    del shards
+
+    # Finished shards are renamed into place, so the output folder never holds half-written files
+    ys, xs = np.divmod(positions, W)
+    manifest = []
+    fmt = output_format()
+    for name, tmp_path, start in zip(base_names, tmp_paths, starts):
+        data = np.load(tmp_path, mmap_mode="r")
+        end = start + len(data)
+        if fmt == "parquet":
+            columns = {"folder": [folder.name] * len(data), "mask": labels[start:end],
+                       "y": ys[start:end], "x": xs[start:end]}
+            columns.update({f"b{wl}": np.ascontiguousarray(data[:, j]) for j, wl in enumerate(WAVELENGTHS)})
+            out_path = Path(OUTPUT_FOLDER) / f"{name}.parquet"
+            pq.write_table(pa.table(columns), str(out_path) + ".tmp")
+            os.replace(str(out_path) + ".tmp", out_path)
+            del data
+            os.remove(tmp_path)
+            manifest.append({"file": out_path.name, "labels": "", "folder": folder.name, "rows": end - start})
+        else:
+            labels_path = Path(OUTPUT_FOLDER) / f"{name}_labels.csv"
+            with open(str(labels_path) + ".tmp", "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(["folder", "mask", "y", "x"])
+                writer.writerows(zip([folder.name] * len(data), labels[start:end], ys[start:end], xs[start:end]))
+            del data
+            os.replace(str(labels_path) + ".tmp", labels_path)
+            out_path = Path(OUTPUT_FOLDER) / f"{name}.npy"
+            os.replace(tmp_path, out_path)
+            manifest.append({"file": out_path.name, "labels": labels_path.name, "folder": folder.name,
+                             "rows": end - start})
+    return manifest
+
+
+# ----------------- MAIN -----------------
+def main():
+    folders = read_folder_list()
+    os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+    print(f"Pixel export ({output_format()}) is in progress. Please, wait.")
+
+    manifest = []
+    with ProcessPoolExecutor(max_workers=WORKERS) as executor:
+        for folder, shards in zip(folders, executor.map(export_folder, folders)):
+            print(f"Finished folder: {folder}  (pixels={sum(s['rows'] for s in shards)})")
+            manifest.extend(shards)
+
+    with open(os.path.join(OUTPUT_FOLDER, "wavelengths.csv"), "w", newline="") as f:
+        csv.writer(f).writerows([["wavelength"]] + [[wl] for wl in WAVELENGTHS])
+    with open(os.path.join(OUTPUT_FOLDER, "manifest.csv"), "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["file", "labels", "folder", "rows"])
+        writer.writeheader()
+        writer.writerows(manifest)
+    print(f"Saved: {OUTPUT_FOLDER}  (shards={len(manifest)}, pixels={sum(s['rows'] for s in manifest)})")
+
+
+if __name__ == "__main__":
+    main()
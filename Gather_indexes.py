@@ -1,5 +1,8 @@
 import os
-import shutil
+from pathlib import Path
+
+from image_writer import ImageWriter
+from spectral_cube import resolve_corrected_folder, list_products
 
 # Name of the master folder where sorted index images will be stored
 INDEXES_ROOT = 'Indexes'
@@ -17,13 +20,16 @@ with open('folder_list.txt', 'r') as f:
 
 # Decide whether to use Corrected_ folders or raw folders
 # If ANY Corrected_<folder> exists, we work in "corrected mode" and only use those
-corrected_mode = any(os.path.isdir('Corrected_' + fld) for fld in folder_list)
+corrected_mode = any(resolve_corrected_folder(Path(fld)) != Path(fld) for fld in folder_list)
 
 if corrected_mode:
     print("Detected 'Corrected_' folders – using only those.")
 else:
     print("No 'Corrected_' folders detected – using original folders from folder_list.txt.")
 
+# Files are copied in background threads; the names already given to queued copies are reserved
+reserved = set()
+
 def safe_copy(src, dst_dir, base_name):
     """
     Copy src into dst_dir with file name base_name + extension.
@@ -33,69 +39,67 @@ def safe_copy(src, dst_dir, base_name):
     _, ext = os.path.splitext(src)
     dest = os.path.join(dst_dir, base_name + ext)
 
-    if os.path.exists(dest):
+    if os.path.exists(dest) or dest in reserved:
         counter = 1
         while True:
             alt = os.path.join(dst_dir, f"{base_name}_{counter}{ext}")
-            if not os.path.exists(alt):
+            if not os.path.exists(alt) and alt not in reserved:
                 dest = alt
                 break
             counter += 1
 
-    shutil.copy2(src, dest)
+    reserved.add(dest)
+    writer.copy(src, dest)
     print(f"  Copied: {src}  -->  {dest}")
 
-# Process each folder / sample
-for sample_name in folder_list:
-    # Determine which folder on disk to use
-    if corrected_mode:
-        folder = 'Corrected_' + sample_name
-    else:
-        folder = sample_name
-
-    if not os.path.isdir(folder):
-        print(f"Skipping '{sample_name}' (folder '{folder}' not found).")
-        continue
-
-    print(f"Processing sample folder: {folder}")
-
-    # Look for Indexes_out and/or Indexes_out_fluorescence inside this folder
-    candidate_subfolders = [
-        os.path.join(folder, 'Indexes_out'),
-        os.path.join(folder, 'Indexes_out_fluorescence')
-    ]
-
-    found_any = False
-
-    for idx_folder in candidate_subfolders:
-        if not os.path.isdir(idx_folder):
-            continue  # skip if this particular index folder doesn't exist
-
-        found_any = True
-        print(f"  Found index folder: {idx_folder}")
-
-        # List image files (common image extensions)
-        for fname in os.listdir(idx_folder):
-            if not fname.lower().endswith(('.jpg', '.jpeg', '.png', '.tif', '.tiff', '.bmp')):
-                continue
-
-            # Determine index name from file name
-            # Expected pattern: Image_INDEXNAME.ext
-            name_no_ext, _ = os.path.splitext(fname)
-            if name_no_ext.startswith('Image_'):
-                index_name = name_no_ext[len('Image_'):]
-            else:
-                # Fallback: use whole name without extension
-                index_name = name_no_ext
-
-            # Destination folder for this index
-            dest_index_folder = os.path.join(INDEXES_ROOT, index_name)
-
-            # Copy and rename image: use original sample name as base
-            src_path = os.path.join(idx_folder, fname)
-            safe_copy(src_path, dest_index_folder, sample_name)
-
-    if not found_any:
-        print(f"  No 'Indexes_out' or 'Indexes_out_fluorescence' found in '{folder}', skipping.")
+with ImageWriter() as writer:
+    # Process each folder / sample
+    for sample_name in folder_list:
+        # Determine which folder on disk to use
+        if corrected_mode:
+            folder = 'Corrected_' + sample_name
+        else:
+            folder = sample_name
+
+        if not os.path.isdir(folder):
+            print(f"Skipping '{sample_name}' (folder '{folder}' not found).")
+            continue
+
+        print(f"Processing sample folder: {folder}")
+
+        # Look for Indexes_out and/or Indexes_out_fluorescence inside this folder (listed in the catalog)
+        found_any = False
+
+        for kind in ('Indexes_out', 'Indexes_out_fluorescence'):
+            index_files = list_products(folder, kind)
+            if not index_files:
+                continue  # skip if this particular index folder doesn't exist
+
+            found_any = True
+            print(f"  Found index folder: {os.path.join(folder, kind)}")
+
+            # List image files (common image extensions)
+            for src in index_files:
+                fname = src.name
+                if not fname.lower().endswith(('.jpg', '.jpeg', '.png', '.tif', '.tiff', '.bmp')):
+                    continue
+
+                # Determine index name from file name
+                # Expected pattern: Image_INDEXNAME.ext
+                name_no_ext, _ = os.path.splitext(fname)
+                if name_no_ext.startswith('Image_'):
+                    index_name = name_no_ext[len('Image_'):]
+                else:
+                    # Fallback: use whole name without extension
+                    index_name = name_no_ext
+
+                # Destination folder for this index
+                dest_index_folder = os.path.join(INDEXES_ROOT, index_name)
+
+                # Copy and rename image: use original sample name as base
+                safe_copy(str(src), dest_index_folder, sample_name)
+
+        if not found_any:
+            print(f"  No 'Indexes_out' or 'Indexes_out_fluorescence' found in '{folder}', skipping.")
 
 print("Done collecting index images into 'Indexes' folder.")
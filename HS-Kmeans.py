@@ -0,0 +1,132 @@
+# This program makes unsupervised clustering (mini-batch k-means) of the pixels of hyperspectral images
+# obtained using MUSES9-HS hyperspectral camera.
+# It uses the 'folder_list.txt' file in the same way as HYPER-S.py (the first three lines are skipped)
+# and takes 'Corrected_' folders when they exist.
+# The spectral cube is streamed in horizontal tiles, so the pixels x bands matrix is never held in memory.
+# Optionally, the clustering runs in the principal components space, the same one that HS-PCA.py computes
+# (PCA of the grayscale band values), which is fitted incrementally tile by tile.
+# For every folder, a label image and a colour image of clusters are saved to <folder>/Clusters_out,
+# and the mean spectra of clusters are saved to 'clusters.xlsx' in the same format as 'spectrum.xlsx'.
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+import pandas as pd
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.decomposition import IncrementalPCA
+
+from spectral_cube import read_folder_list, resolve_corrected_folder, open_cube, iter_tiles, tile_pixels
+
+# ----------------- CONFIG -----------------
+N_CLUSTERS = 8
+USE_PCA = True  # cluster in PCA space instead of raw band values
+N_COMPONENTS = 10  # number of principal components used for clustering
+TILE_ROWS = 64  # image rows per streamed tile
+BATCH_SIZE = 4096  # pixels per mini-batch
+N_PASSES = 2  # passes over the cube while fitting k-means
+RANDOM_STATE = 0
+WORKERS = os.cpu_count()  # folders processed in parallel
+
+OUTPUT_SUBFOLDER = 'Clusters_out'
+OUTPUT_XLSX = 'clusters.xlsx'
+
+
+def iter_batches(pixels: np.ndarray, rng: np.random.Generator):
+    """Split the pixels of a tile into shuffled mini-batches."""
+    order = rng.permutation(len(pixels))
+    for start in range(0, len(order), BATCH_SIZE):
+        yield pixels[order[start:start + BATCH_SIZE]]
+
+
+def cluster_folder(folder):
+    """Cluster the pixels of one folder. Returns (folder name, waves, cluster means, cluster SDs)."""
+    rng = np.random.default_rng(RANDOM_STATE)
+
+    with open_cube(folder) as (waves, cube):
+        n_bands, height, width = cube.shape
+
+        # Fit the principal components incrementally
+        pca = None
+        if USE_PCA:
+            pca = IncrementalPCA(n_components=min(N_COMPONENTS, n_bands))
+            for _, _, tile in iter_tiles(cube, TILE_ROWS):
+                pixels = tile_pixels(tile)
+                if len(pixels) >= pca.n_components:
+                    pca.partial_fit(pixels)
+
+        # Fit k-means on mini-batches of pixels
+        kmeans = MiniBatchKMeans(n_clusters=N_CLUSTERS, batch_size=BATCH_SIZE, random_state=RANDOM_STATE, n_init=3)
+        carry = None  # pixels left over until the first batch has at least N_CLUSTERS samples
+        for _ in range(N_PASSES):
+            for _, _, tile in iter_tiles(cube, TILE_ROWS):
+                features = tile_pixels(tile)
+                if pca is not None:
+                    features = pca.transform(features)
+                for batch in iter_batches(features, rng):
+                    if carry is not None:
+                        batch = np.vstack([carry, batch])
+                        carry = None
+                    if not hasattr(kmeans, 'cluster_centers_') and len(batch) < N_CLUSTERS:
+                        carry = batch
+                        continue
+                    kmeans.partial_fit(batch)
+
+        # Label every pixel and accumulate the spectra of clusters in the same pass
+        labels = np.zeros((height, width), dtype=np.uint8)
+        counts = np.zeros(N_CLUSTERS, dtype=np.int64)
+        sums = np.zeros((N_CLUSTERS, n_bands), dtype=np.float64)
+        sums_sq = np.zeros((N_CLUSTERS, n_bands), dtype=np.float64)
+        for r0, r1, tile in iter_tiles(cube, TILE_ROWS):
+            pixels = tile_pixels(tile)
+            features = pca.transform(pixels) if pca is not None else pixels
+            tile_labels = kmeans.predict(features)
+            labels[r0:r1] = tile_labels.reshape(r1 - r0, width)
+            counts += np.bincount(tile_labels, minlength=N_CLUSTERS)
+            one_hot = np.eye(N_CLUSTERS, dtype=np.float64)[tile_labels]
+            sums += one_hot.T @ pixels
+            sums_sq += one_hot.T @ (pixels.astype(np.float64) ** 2)
+
+    n = np.maximum(counts, 1)[:, None]
+    means = sums / n
+    sds = np.sqrt(np.maximum(sums_sq / n - means ** 2, 0.0))
+
+    # Save the label image (values 0..N_CLUSTERS-1) and a colour image for viewing
+    out_folder = os.path.join(folder, OUTPUT_SUBFOLDER)
+    os.makedirs(out_folder, exist_ok=True)
+    cv2.imwrite(os.path.join(out_folder, 'Labels.png'), labels)
+    colour = cv2.applyColorMap((labels * (255 // max(N_CLUSTERS - 1, 1))).astype(np.uint8), cv2.COLORMAP_JET)
+    cv2.imwrite(os.path.join(out_folder, 'Image_clusters.jpg'), colour)
+
+    return str(folder), waves, means, sds
+
+
+def main():
+    folders = [resolve_corrected_folder(f) for f in read_folder_list()]
+    folders = [f for f in folders if f.is_dir()]
+    if not folders:
+        raise RuntimeError('No folders to process (after skipping first 3 lines).')
+
+    print('Mini-batch k-means clustering is in progress. Please, wait.')
+    df_mean = pd.DataFrame()
+    df_sd = pd.DataFrame()
+    with ProcessPoolExecutor(max_workers=WORKERS) as executor:
+        for folder_name, waves, means, sds in executor.map(cluster_folder, folders):
+            print('Finished folder: ' + folder_name)
+            for k in range(N_CLUSTERS):
+                column = folder_name + '|Cluster_' + str(k + 1)
+                df_mean = pd.concat([df_mean, pd.Series(means[k], index=waves, name=column)], axis=1)
+                df_sd = pd.concat([df_sd, pd.Series(sds[k], index=waves, name=column)], axis=1)
+
+    df_mean.index.name = 'Wavelength'
+    df_sd.index.name = 'Wavelength'
+    with pd.ExcelWriter(OUTPUT_XLSX, engine='xlsxwriter') as writer:
+        df_mean.to_excel(writer, sheet_name='Means', index=True)
+        df_sd.to_excel(writer, sheet_name='SD', index=True)
+
+    print('Finished!')
+
+
+if __name__ == '__main__':
+    main()
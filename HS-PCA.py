@@ -1,44 +1,39 @@
 # This program makes principal components analysis for hyperspectral images obtained 
 # using MUSES9-HS hyperspectral camera.
 # This program should be run from within a folder containing the 'Spectral_Cube' folder.
+# Alternatively, the folder and the output folder can be given in the command line:
+#   python HS-PCA.py <folder with Spectral_Cube> [<output folder>]
 
 import os
-import cv2
+import sys
 import numpy as np
 import pandas as pd
 from sklearn import decomposition
 import warnings
 
-file_list = os.listdir('Spectral_Cube/')
-waves = []
+from image_writer import ImageWriter
+from spectral_cube import iter_bands
 
-for file in file_list:
-    if 'image' in file:
-        waves.append(int(file[5:file.find('.')]))
-
-waves = sorted(waves)
-
-scale = 0.5
-roi_size = 1  # We take the size of the square for averaging
-file_extension = 'jpg'  # We check the file extension of images
+# Load-time binning. None takes the shared settings of spectral_cube.py; a value overrides them for this program.
+# SPATIAL_BIN = 2 averages 2x2 blocks of pixels (as the former scale of 0.5 did), which keeps the PCA of large
+# images fast; None or 1 analyses every pixel.
+SPATIAL_BIN = 2
+SPECTRAL_BIN_NM = None
+BAND_SUBSET = None
 warnings.simplefilter(action='ignore', category=pd.errors.PerformanceWarning)
 
-if not os.path.exists('Spectral_Cube/image1000.' + file_extension):
-    file_extension = 'png'
+cube_folder = sys.argv[1] if len(sys.argv) > 1 else '.'
+out_folder = sys.argv[2] if len(sys.argv) > 2 else os.path.join(cube_folder, 'PCA-Out')
 
 df_spectrum = pd.DataFrame()
 n = 0
 
-for wave_length in waves:
+for wave_length, gray_image in iter_bands(cube_folder, spectral_bin_nm=SPECTRAL_BIN_NM, band_subset=BAND_SUBSET,
+                                          spatial_bin=SPATIAL_BIN):
     n += 1
     print(str(wave_length) + '-nm image uploaded', end='')
-    single_wave_array = []
-    image = cv2.imread('Spectral_Cube/image' + str(wave_length) + '.' + file_extension)
-    height = image.shape[0]
-    width = image.shape[1]
-    dim = (int(width * scale), int(height * scale))
-    small_image = cv2.resize(image, dim, interpolation=cv2.INTER_LINEAR)
-    gray_image = cv2.cvtColor(small_image, cv2.COLOR_BGR2GRAY)
+    height = gray_image.shape[0]
+    width = gray_image.shape[1]
     single_wave_array = np.array(gray_image).flatten()
     df_spectrum[wave_length] = single_wave_array
     print('\r', end='')
@@ -47,36 +42,40 @@ for wave_length in waves:
 print('Principal component analysis is in progress. Please, wait.')
 pca = decomposition.PCA()
 spectral_pc = pca.fit_transform(df_spectrum)
-spectral_pc_df = pd.DataFrame(data=spectral_pc, columns=['PC' + str(i) for i in range(n)])
+spectral_pc_df = pd.DataFrame(data=spectral_pc, columns=['PC' + str(i) for i in range(spectral_pc.shape[1])])
 # print(spectral_pc_df)
 
-if not os.path.exists('PCA-Out'):
-    os.mkdir('PCA-Out')
-
-for pc in range(10):
-    out_image = np.array(spectral_pc_df['PC' + str(pc)]).reshape([int(height * scale), int(width * scale)])
-    out_image = 255 * (out_image - out_image.min()) / (out_image.max() - out_image.min())
-    print('Image_PC' + str(pc + 1) + ' is in progress', end='')
-    cv2.imwrite('PCA-Out/Image_PC' + str(pc + 1) + '.jpg', out_image)
-    print('\r', end='')
-
-# Load the grayscale images for red, green, and blue channels
-print('Color images are in progress.')
-for start in range(10 - 2):
-    folder = 'PCA-Out/Image_PC'
-    red_channel = cv2.imread(folder + str(start + 1) + '.jpg', 0)
-    green_channel = cv2.imread(folder + str(start + 2) + '.jpg', 0)
-    blue_channel = cv2.imread(folder + str(start + 3) + '.jpg', 0)
-
-    # Create an empty RGB image
-    rgb_image = np.zeros((red_channel.shape[0], red_channel.shape[1], 3), dtype=np.uint8)
-
-    # Assign the grayscale images to the corresponding color channels of the RGB image
-    rgb_image[:, :, 0] = blue_channel  # Blue channel
-    rgb_image[:, :, 1] = green_channel  # Green channel
-    rgb_image[:, :, 2] = red_channel  # Red channel
-
-    # Display the RGB image
-    cv2.imwrite('PCA-Out/RGB-ImagePC_' + str(start + 1) + '-' + str(start + 2) + '-' + str(start + 3) + '.jpg', rgb_image)
-
-print('Finished!')
+os.makedirs(out_folder, exist_ok=True)
+
+# Images are written in background threads; the PC images are kept in memory for the colour images
+with ImageWriter() as writer:
+    pc_images = []
+    for pc in range(min(10, n)):
+        out_image = np.array(spectral_pc_df['PC' + str(pc)]).reshape([height, width])
+        out_image = 255 * (out_image - out_image.min()) / (out_image.max() - out_image.min())
+        out_image = np.clip(np.rint(out_image), 0, 255).astype(np.uint8)
+        print('Image_PC' + str(pc + 1) + ' is in progress', end='')
+        writer.imwrite(os.path.join(out_folder, 'Image_PC' + str(pc + 1) + '.jpg'), out_image)
+        pc_images.append(out_image)
+        print('\r', end='')
+
+    # Take the grayscale PC images for red, green, and blue channels
+    print('Color images are in progress.')
+    for start in range(min(10, n) - 2):
+        red_channel = pc_images[start]
+        green_channel = pc_images[start + 1]
+        blue_channel = pc_images[start + 2]
+
+        # Create an empty RGB image
+        rgb_image = np.zeros((red_channel.shape[0], red_channel.shape[1], 3), dtype=np.uint8)
+
+        # Assign the grayscale images to the corresponding color channels of the RGB image
+        rgb_image[:, :, 0] = blue_channel  # Blue channel
+        rgb_image[:, :, 1] = green_channel  # Green channel
+        rgb_image[:, :, 2] = red_channel  # Red channel
+
+        # Display the RGB image
+        writer.imwrite(os.path.join(out_folder, 'RGB-ImagePC_' + str(start + 1) + '-' + str(start + 2) + '-' + str(start + 3) + '.jpg'),
+                       rgb_image)
+
+print('Finished!')
\ No newline at end of file
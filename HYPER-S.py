@@ -5,11 +5,25 @@
 # Dark_current -- is not used by this program (could be empty line)
 # Flat_field -- is not used by this program (could be empty line)
 # Object_folder -- the images of the object of interest. The 'Spectral_Cube' folder should be within this folder.
+# The spectra are cached (see spectrum_cache.py): selecting the same ROI of an unchanged cube again with the same
+# background and sd_number does not read the images again.
+# The displayed band is scaled by its percentiles from the band statistics of the cube (see band_stats.py),
+# so that the dark UV bands can be seen too; the spectra and the ROI screenshots are made from the original images.
+# The spectra are calculated in the background: new ROIs can be selected while the previous ones are calculated
+# (they are queued), the progress is shown in the window, and <c> cancels the last selected ROI.
 
 import cv2
 import numpy as np
 import pandas as pd
 import os
+import queue
+import threading
+import traceback
+from pathlib import Path
+
+import band_stats
+import spectrum_cache
+from spectral_cube import list_spectral_images, band_extension
 
 
 def select_rectangle(event, x, y, flags, param):
@@ -35,6 +49,103 @@ def select_rectangle(event, x, y, flags, param):
         cv2.imshow("Image", image_1000)
 
 
+def read_band_image(image_path, wave_length):
+    """A band image for the window, with the contrast stretched by the statistics of the band."""
+    image = cv2.imread(image_path)
+    if display_stretch and wave_length in band_statistics:
+        image = band_stats.stretch(image, band_statistics[wave_length])
+    return image
+
+
+def roi_screenshot(image_path, wave_length, shape, top_left, bottom_right):
+    """The selected ROI drawn on the original band image (without the display stretch), of the displayed size."""
+    image = cv2.imread(image_path)
+    if image.shape[:2] != shape[:2]:
+        image = cv2.resize(image, (shape[1], shape[0]))
+    cv2.rectangle(image, top_left, bottom_right, (0, 255, 0), 1)
+    cv2.putText(image, str(wave_length), (max_width - 70, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 1)
+    return image
+
+
+def roi_spectrum(folder_name, file_extension, waves, rect, base_wave, background_spectrum, sd_number,
+                 progress=None, cancel=None):
+    """
+    Spectrum of the rectangle rect = (y0, y1, x0, x1) of the full-size images as [[wave_length, mean, sd], ...].
+    With background_spectrum, only the pixels brighter than (mean_background + sd_number*SD) are accounted for,
+    and the sum is divided by the basal number of pixels on the base_wave image.
+    Without it (None), the background itself is measured.
+    progress(done, total) is called after every band; None is returned as soon as the cancel event is set.
+    """
+    y0, y1, x0, x1 = rect
+    base = 0
+    if background_spectrum is not None:
+        # Counting the number of lit pixels on 1000 nm shot.
+        # We do it because on 1000 nm image the reflectance values are usually high enough,
+        # especially in comparison to UV range reflectances.
+        # Thus, we take the number of lit pixels in 1000 nm image as a base number of pixels.
+        # In next steps we will summarize intensities of pixels over entire ROI and divide by the basal
+        # number of pixels. This is made because the image of an object can move a bit from
+        # one wavelength to another.
+        image = cv2.imread(folder_name + '/Spectral_Cube/image' + str(base_wave) + '.' + file_extension)
+        value_array = np.array(image[y0:y1, x0:x1])
+        min_value = 0
+        for i in background_spectrum:
+            if i[0] == 1000:
+                min_value = i[1] + sd_number * i[2]
+        if len(value_array[value_array > min_value]) > 0:
+            base = np.count_nonzero(value_array[value_array > min_value])
+            print('Basal number of pixels = ' + str(base))
+
+    result = []
+    for wave_length in waves:
+        if cancel is not None and cancel.is_set():
+            return None
+        image = cv2.imread(folder_name + '/Spectral_Cube/image' + str(wave_length) + '.' + file_extension)
+        value_array = np.array(image[y0:y1, x0:x1])
+        min_value = 0
+        if background_spectrum is not None:
+            for i in background_spectrum:
+                if i[0] == wave_length:
+                    min_value = i[1] + sd_number * i[2]
+        if len(value_array[value_array > min_value]) > 0 and base > 0:
+            mean_value = value_array[value_array > min_value].sum() / base
+            base2 = np.count_nonzero(value_array[value_array > min_value])
+            sd_value = (value_array[value_array > min_value].std() ** 2 * base2 / base) ** 0.5
+        elif len(value_array[value_array > min_value]) > 0 and base == 0:
+            mean_value = value_array[value_array > min_value].mean()
+            sd_value = value_array[value_array > min_value].std()
+        else:
+            mean_value = 0
+            sd_value = 0
+        result.append([wave_length, float(mean_value), float(sd_value)])
+        if progress is not None:
+            progress(len(result), len(waves))
+    return result
+
+
+def roi_worker():
+    """
+    Calculates the queued ROIs one by one; (job, spectrum) goes to roi_results,
+    spectrum is None if cancelled or failed (the error is printed and the next ROIs are still calculated).
+    """
+    while True:
+        job = roi_jobs.get()
+        result = None
+        try:
+            if not job['cancel'].is_set():
+                result = roi_spectrum(job['folder_name'], job['file_extension'], waves, job['rect'], job['base_wave'],
+                                      job['background'], job['sd_number'],
+                                      progress=lambda done, total: job.update(progress=done / total),
+                                      cancel=job['cancel'])
+                if result is not None:
+                    spectrum_cache.put(job['cache_key'], result)
+        except Exception:
+            print(f"The {job['kind']} ROI of {job['folder_name']} could not be calculated, please select it again:")
+            traceback.print_exc()
+            result = None
+        roi_results.put((job, result))
+
+
 print('This program takes the spectrum of the region of interest (ROI) from hyperspectral camera images.')
 folder_prefix_corrected = input('Do you want to process folders with prefix <Corrected_> ? (y/n):')
 yes = ['y', 'Y']
@@ -54,17 +165,13 @@ folder_number = 0
 # window size to display images
 max_width = 800
 max_height = 600
+# Stretch the contrast of the displayed band between its 1st and 99th percentiles (False shows the original images)
+display_stretch = True
 
 # waves = [365] + list(range(400, 1001, 5))
 
-file_list = os.listdir(folder_list[3] + '/Spectral_Cube')
-waves = []
-
-for file in file_list:
-    if 'image' in file:
-        waves.append(file[5:file.find('.')])
-
-waves = sorted(waves, key=int)
+# The band list is taken from the catalog (see catalog.py)
+waves = [str(wave_length) for wave_length, _ in list_spectral_images(Path(folder_list[3]))]
 spectral_bands = []
 
 for wave_length in waves:
@@ -80,6 +187,11 @@ df_sd.index = spectral_bands
 df_mean.index.name = 'Wavelength'
 df_sd.index.name = 'Wavelength'
 
+# The spectra of the selected ROIs are calculated in a background thread
+roi_jobs = queue.Queue()
+roi_results = queue.Queue()
+threading.Thread(target=roi_worker, daemon=True).start()
+
 for folder_name in folder_list:
     folder_number += 1
     if folder_number < 4:
@@ -92,14 +204,15 @@ for folder_name in folder_list:
     # Load the image for area selection
     band = len(spectral_bands) - 1
     image_file = folder_name + '/Spectral_Cube/image' + str(spectral_bands[band])
-    file_extension = 'jpg'
-    if not os.path.exists(image_file + '.' + file_extension):
-        file_extension = 'png'
+    file_extension = band_extension(Path(folder_name))
+    cube_checksum = spectrum_cache.cube_checksum(Path(folder_name))
+    band_statistics = band_stats.load_band_stats(folder_name) if display_stretch else {}
 
-    image_1000 = cv2.imread(image_file + '.' + file_extension)
+    image_1000 = read_band_image(image_file + '.' + file_extension, spectral_bands[band])
     print('The file extension of images is ' + file_extension + '.')
 
     # Resize the image_1000 to fit the screen
+    scale = 1
     if image_1000.shape[1] > max_width or image_1000.shape[0] > max_height:
         scale = min(max_width / image_1000.shape[1], max_height / image_1000.shape[0])
         image_1000 = cv2.resize(image_1000, None, fx=scale, fy=scale)
@@ -111,6 +224,7 @@ for folder_name in folder_list:
     print('Please, make the image window active.')
     print('Use <w> and <s> keys to select an image on different wavelength.')
     print('To move to the next folder, press <n>, or <q> to quit.')
+    print('ROIs are calculated in the background; press <c> to cancel the last selected ROI.')
     print('First, using mouse select a part of black background.')
     print('Press <x> if there is no black background or you do not wish to remove it.')
     # The idea is that the intensities of pixels within ROI will be summarized,
@@ -128,17 +242,25 @@ for folder_name in folder_list:
     j = 0
     background_spectrum = []
     background_measured = False
-    base = 0
+    roi_pending = []  # selected ROIs whose spectra are not ready yet, in the order of selection
+    leaving = False
 
     while True:
-        cv2.imshow("Image", image_1000)
+        # Show the progress of the ROIs calculated in the background (not drawn on the saved screenshots)
+        if roi_pending:
+            display = image_1000.copy()
+            cv2.putText(display, f"ROI: {int(roi_pending[0]['progress'] * 100)}%, queued: {len(roi_pending) - 1}, "
+                                 f"<c> - cancel", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 1)
+            cv2.imshow("Image", display)
+        else:
+            cv2.imshow("Image", image_1000)
         key = cv2.waitKey(1) & 0xFF
         cv2.putText(image_1000, str(spectral_bands[band]), (max_width - 70, 30),
                     cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 1)
 
         # Press 'r' to reset the selection
         if key == ord("r") or finished:
-            image_1000 = cv2.imread(image_file + '.' + file_extension)
+            image_1000 = read_band_image(image_file + '.' + file_extension, spectral_bands[band])
             if image_1000.shape[1] > max_width or image_1000.shape[0] > max_height:
                 scale = min(max_width / image_1000.shape[1], max_height / image_1000.shape[0])
                 image_1000 = cv2.resize(image_1000, None, fx=scale, fy=scale)
@@ -150,7 +272,7 @@ for folder_name in folder_list:
             if band != 0:
                 band = band - 1
             image_file = folder_name + '/Spectral_Cube/image' + str(spectral_bands[band])
-            image_1000 = cv2.imread(image_file + '.' + file_extension)
+            image_1000 = read_band_image(image_file + '.' + file_extension, spectral_bands[band])
             if image_1000.shape[1] > max_width or image_1000.shape[0] > max_height:
                 scale = min(max_width / image_1000.shape[1], max_height / image_1000.shape[0])
                 image_1000 = cv2.resize(image_1000, None, fx=scale, fy=scale)
@@ -161,92 +283,61 @@ for folder_name in folder_list:
             if band != len(spectral_bands) - 1:
                 band = band + 1
             image_file = folder_name + '/Spectral_Cube/image' + str(spectral_bands[band])
-            image_1000 = cv2.imread(image_file + '.' + file_extension)
+            image_1000 = read_band_image(image_file + '.' + file_extension, spectral_bands[band])
             if image_1000.shape[1] > max_width or image_1000.shape[0] > max_height:
                 scale = min(max_width / image_1000.shape[1], max_height / image_1000.shape[0])
                 image_1000 = cv2.resize(image_1000, None, fx=scale, fy=scale)
             top_left_pt = None
             bottom_right_pt = None
 
-        elif key == ord('x'):
+        elif key == ord('x') and not background_measured and not roi_pending:
             for wave_length in waves:
                 background_spectrum.append([wave_length, 0, 0])
             background_measured = True
             print('No background will be subtracted.')
             print('Use a mouse to select ROI, or press <n> to move to the next folder, or <q> to quit.')
 
+        # Press 'c' to cancel the last selected ROI
+        elif key == ord('c'):
+            for job in reversed(roi_pending):
+                if not job['cancel'].is_set():
+                    job['cancel'].set()
+                    print('The last selected ROI is cancelled.')
+                    break
+
         # Press 'q' to quit the program
         elif key == ord('q'):
+            for job in roi_pending:
+                job['cancel'].set()
             exit()
 
         elif key == ord('n'):
-            break
-
-        # Display the selected coordinates
-        if selecting and top_left_pt is not None:
-            finished = False
-        if not selecting and top_left_pt is not None and bottom_right_pt is not None and not finished:
-            spectrum = []
-            print('Wait.')
-            # Counting the number of lit pixels on 1000 nm shot.
-            # We do it because on 1000 nm image the reflectance values are usually high enough,
-            # especially in comparison to UV range reflectances.
-            # Thus, we take the number of lit pixels in 1000 nm image as a base number of pixels.
-            # In next steps we will summarize intensities of pixels over entire ROI and divide by the basal
-            # number of pixels. This is made because the image of an object can move a bit from
-            # one wavelength to another.
-            if background_measured:
-                image_file = folder_name + '/Spectral_Cube/image' + str(spectral_bands[band])
-                image = cv2.imread(image_file + '.' + file_extension)
-                roi = image[int(top_left_pt[1] / scale):int(bottom_right_pt[1] / scale),
-                      int(top_left_pt[0] / scale):int(bottom_right_pt[0] / scale)]
-                value_array = np.array(roi)
-                min_value = 0
-                for i in background_spectrum:
-                    if i[0] == 1000:
-                        min_value = i[1] + sd_number * i[2]
-                if len(value_array[value_array > min_value]) > 0:
-                    base = np.count_nonzero(value_array[value_array > min_value])
-                    print('Basal number of pixels = ' + str(base))
-                    print('Wait.')
-
-            for wave_length in waves:
-                image = cv2.imread(folder_name + '/Spectral_Cube/image' + str(wave_length) + '.' + file_extension)
-                roi = image[int(top_left_pt[1] / scale):int(bottom_right_pt[1] / scale),
-                      int(top_left_pt[0] / scale):int(bottom_right_pt[0] / scale)]
-                value_array = np.array(roi)
-                min_value = 0
-                if background_measured:
-                    for i in background_spectrum:
-                        if i[0] == wave_length:
-                            min_value = i[1] + sd_number * i[2]
-                if len(value_array[value_array > min_value]) > 0 and base > 0:
-                    mean_value = value_array[value_array > min_value].sum() / base
-                    base2 = np.count_nonzero(value_array[value_array > min_value])
-                    sd_value = (value_array[value_array > min_value].std() ** 2 * base2 / base) ** 0.5
-                elif len(value_array[value_array > min_value]) > 0 and base == 0:
-                    mean_value = value_array[value_array > min_value].mean()
-                    sd_value = value_array[value_array > min_value].std()
-                else:
-                    mean_value = 0
-                    sd_value = 0
-                if background_measured:
-                    spectrum.append([wave_length, mean_value, sd_value])
-                else:
-                    background_spectrum.append([wave_length, mean_value, sd_value])
-
-            background_measured_past = background_measured
-
-            if len(background_spectrum) > 1:
+            if not roi_pending:
+                break
+            leaving = True
+            print(f'Waiting for {len(roi_pending)} ROI(s) before moving to the next folder (<c> cancels them).')
+
+        # Collect the spectra calculated in the background (or taken from the cache) in the order of selection,
+        # so that the measurements are numbered as they were selected
+        while not roi_results.empty():
+            job, result = roi_results.get()
+            job['done'] = True
+            job['result'] = result
+        while roi_pending and roi_pending[0]['done']:
+            job = roi_pending.pop(0)
+            result = job['result']
+            if result is None or job['cancel'].is_set():
+                continue
+
+            if job['kind'] == 'background':
+                background_spectrum = result
                 background_measured = True
-
-            if background_measured != background_measured_past:
                 print('Background was measured. Now the pixels lower than (mean_background + 7*SD)')
                 print('will not be accounted for in ROI that will be selected further.')
                 print('To change the number before SD in the formula, edit the program line 120.')
                 print('')
                 print('Please, select ROI or press <n> to move to the next folder, or <q> to quit without saving.')
-                cv2.imwrite('ROI/' + folder_name + '_Background.' + file_extension, image_1000)
+                cv2.imwrite('ROI/' + folder_name + '_Background.' + file_extension, job['screenshot'])
                 means = []
                 sds = []
                 for out in background_spectrum:
@@ -255,21 +346,53 @@ for folder_name in folder_list:
                 df_mean[folder_name + '|Background'] = means
                 df_sd[folder_name + '|Background'] = sds
 
-            if len(spectrum) > 0:
+            else:
                 print('Select another ROI or press <n> to move to the next folder, or <q> to quit without saving.')
-                cv2.imwrite('ROI/' + folder_name + '_Measurement_' + str(j) + '.' + file_extension, image_1000)
+                cv2.imwrite('ROI/' + folder_name + '_Measurement_' + str(j) + '.' + file_extension, job['screenshot'])
                 j += 1
                 means = []
                 sds = []
-                for out in spectrum:
+                for out in result:
                     means.append(out[1])
                     sds.append(out[2])
                 df_mean[folder_name + '|Measurement_' + str(j)] = means
                 df_sd[folder_name + '|Measurement_' + str(j)] = sds
+
+        if leaving and not roi_pending:
+            break
+
+        # Display the selected coordinates
+        if selecting and top_left_pt is not None:
+            finished = False
+        if not selecting and top_left_pt is not None and bottom_right_pt is not None and not finished:
+            if not background_measured and roi_pending:
+                print('The background is being measured. Please, select ROI when it is ready.')
+            elif not leaving:
+                rect = (int(top_left_pt[1] / scale), int(bottom_right_pt[1] / scale),
+                        int(top_left_pt[0] / scale), int(bottom_right_pt[0] / scale))
+                background = background_spectrum if background_measured else None
+                job = {'kind': 'measurement' if background_measured else 'background',
+                       'folder_name': folder_name, 'file_extension': file_extension, 'rect': rect,
+                       'base_wave': spectral_bands[band], 'background': background, 'sd_number': sd_number,
+                       # The same ROI with the same background and sd_number is taken from the cache
+                       'cache_key': spectrum_cache.make_key('roi', cube_checksum, rect, spectral_bands[band],
+                                                            background, sd_number),
+                       'screenshot': roi_screenshot(image_file + '.' + file_extension, spectral_bands[band],
+                                                    image_1000.shape, top_left_pt, bottom_right_pt),
+                       'cancel': threading.Event(), 'progress': 0.0, 'done': False, 'result': None}
+                roi_pending.append(job)
+                result = spectrum_cache.get(job['cache_key'])
+                if result is not None:
+                    roi_results.put((job, result))
+                else:
+                    roi_jobs.put(job)
+                    print(f'ROI is queued ({len(roi_pending)} in progress).')
             finished = True
 
     cv2.destroyAllWindows()
 
+spectrum_cache.evict()
+
 with pd.ExcelWriter('spectrum.xlsx', engine='xlsxwriter') as writer:
     df_mean.to_excel(writer, sheet_name='Means', index=True)
     df_sd.to_excel(writer, sheet_name='SD', index=True)
\ No newline at end of file
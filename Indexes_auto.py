@@ -1,77 +1,47 @@
 # This program will calculate spectral index images from hyperspectral data
+# The indices and their formulas are listed in spectral_indices.py
 import os
+from pathlib import Path
+
 import cv2
 import numpy as np
 
-# Small epsilon to avoid division by zero
-EPS = 1e-6
-
-# List of all wavelengths needed for the indices
-REQUIRED_WAVELENGTHS = sorted(list(set([
-    420, 430, 440, 450,
-    500, 510, 530, 550, 570,
-    670, 680, 700, 710, 720, 730, 740, 750,
-    800, 840,
-    900, 970
-])))
-
-
-def choose_folder(folder_name: str) -> str:
-    """If Corrected_<folder> exists, use it; else use the original folder."""
-    corrected = "Corrected_" + folder_name
-    return corrected if os.path.isdir(corrected) else folder_name
-
-
-# Reading the folder list from file
-with open('folder_list.txt', 'r') as f1:
-    folder_list = [line.strip() for line in f1 if line.strip()]
+from image_writer import ImageWriter
+from spectral_cube import bin_spatial, SPATIAL_BIN, resolve_corrected_folder, list_spectral_images
+from spectral_indices import INDICES, REQUIRED_WAVELENGTHS
 
-folder_number = 0
 
-for folder in folder_list:
-    folder_number += 1
-
-    # Keep the original behavior of skipping the first 3 folders
-    if folder_number < 4:
-        continue
-
-    folder = choose_folder(folder)
+def compute_indexes(folder: str, writer: ImageWriter, index_out_folder: str | None = None):
+    """
+    Calculate all index images of one folder from folder_list.txt and queue them to the writer.
+    Corrected_<folder> is used if it exists. The images go to <folder>/Indexes_out unless index_out_folder is given.
+    """
+    # Corrected_<folder> is used if it exists; folders and bands are resolved through the catalog (see catalog.py)
+    folder = str(resolve_corrected_folder(Path(folder)))
     print(f"Processing folder: {folder}")
 
-    from collections import Counter
-
-    # Detect most frequent file extension (jpg or png) in Spectral_Cube
-    spectral_dir = os.path.join(folder, 'Spectral_Cube')
-
-    extensions = []
-    for fname in os.listdir(spectral_dir):
-        if fname.lower().startswith('image') and fname.lower().endswith(('.jpg', '.png')):
-            extensions.append(os.path.splitext(fname)[1].lower())
-
-    if not extensions:
-        raise RuntimeError(f"No image jpg/png files found in {spectral_dir}")
-
-    file_extension = Counter(extensions).most_common(1)[0][0].lstrip('.')
-
-    spectral_cube_path = os.path.join(folder, 'Spectral_Cube')
+    band_files = dict(list_spectral_images(Path(folder)))
+    if not band_files:
+        raise RuntimeError(f"No image jpg/png files found in {os.path.join(folder, 'Spectral_Cube')}")
 
     # Load all required bands into memory as grayscale float32
     bands = {}
     for wl in REQUIRED_WAVELENGTHS:
-        img_path = os.path.join(spectral_cube_path, f"image{wl}.{file_extension}")
-        if not os.path.exists(img_path):
+        if wl not in band_files:
             raise FileNotFoundError(
-                f"Expected band image not found: {img_path}. "
+                f"Expected band image not found for {wl} nm in {os.path.join(folder, 'Spectral_Cube')}. "
                 f"Index calculation requires wavelength {wl} nm."
             )
-        # Load as grayscale
+        img_path = str(band_files[wl])
+        # Load as grayscale, with the shared load-time spatial binning (SPATIAL_BIN in spectral_cube.py)
         img = cv2.imread(img_path, cv2.IMREAD_GRAYSCALE)
         if img is None:
             raise IOError(f"Could not read image: {img_path}")
-        bands[wl] = img.astype(np.float32)
+        bands[wl] = bin_spatial(img, SPATIAL_BIN).astype(np.float32)
 
     # Create output folder for indices
-    index_out_folder = os.path.join(folder, 'Indexes_out')
+    if index_out_folder is None:
+        index_out_folder = os.path.join(folder, 'Indexes_out')
     if not os.path.exists(index_out_folder):
         os.makedirs(index_out_folder)
 
@@ -178,108 +148,34 @@ for folder in folder_list:
         out_img = cv2.hconcat([heatmap, legend])
 
         out_path = os.path.join(index_out_folder, f"Image_{name}.jpg")
-        cv2.imwrite(out_path, out_img)
+        writer.imwrite(out_path, out_img)
         print(f"Saved {out_path} (vmin={vmin:.5g}, vmax={vmax:.5g})")
 
-    # Shortcuts for bands (for readability)
-    R420 = bands[420]
-    R430 = bands[430]
-    R440 = bands[440]
-    R450 = bands[450]
-    R500 = bands[500]
-    R510 = bands[510]
-    R530 = bands[530]
-    R550 = bands[550]
-    R570 = bands[570]
-    R670 = bands[670]
-    R680 = bands[680]
-    R700 = bands[700]
-    R710 = bands[710]
-    R720 = bands[720]
-    R730 = bands[730]
-    R740 = bands[740]
-    R750 = bands[750]
-    R800 = bands[800]
-    R840 = bands[840]
-    R900 = bands[900]
-    R970 = bands[970]
-
-    # Now compute all indices
-
-    # ARI1 = 1 / R550 - 1 / R700
-    ARI1 = 1.0 / (R550 + EPS) - 1.0 / (R700 + EPS)
-    save_index_heatmap(ARI1, 'ARI1')
-
-    # ARI2 = R800 * (1/R550 - 1/R700)
-    ARI2 = R800 * (1.0 / (R550 + EPS) - 1.0 / (R700 + EPS))
-    save_index_heatmap(ARI2, 'ARI2')
-
-    # CARI = R720 / R510 - 1
-    CARI = (R720 / (R510 + EPS)) - 1.0
-    save_index_heatmap(CARI, 'CARI')
-
-    # CRI1 = 1/R510 - 1/R550
-    CRI1 = 1.0 / (R510 + EPS) - 1.0 / (R550 + EPS)
-    save_index_heatmap(CRI1, 'CRI1')
-
-    # CRI2 = 1/R510 - 1/R700
-    CRI2 = 1.0 / (R510 + EPS) - 1.0 / (R700 + EPS)
-    save_index_heatmap(CRI2, 'CRI2')
-
-    # CI_rededge = R840 / R720 - 1
-    CI_rededge = (R840 / (R720 + EPS)) - 1.0
-    save_index_heatmap(CI_rededge, 'CI_rededge')
-
-    # GM1 = R750 / R550
-    GM1 = R750 / (R550 + EPS)
-    save_index_heatmap(GM1, 'GM1')
-
-    # GM2 = R750 / R700
-    GM2 = R750 / (R700 + EPS)
-    save_index_heatmap(GM2, 'GM2')
-
-    # NPCI = (R680 - R430) / (R680 + R430)  --> normalized difference, fix scale [-1, 1]
-    NPCI = (R680 - R430) / (R680 + R430 + EPS)
-    save_index_heatmap(NPCI, 'NPCI', fixed_range=(-1.0, 1.0))
-
-    # NPQI = (R420 - R440) / (R420 + R440)  --> normalized difference, fix scale [-1, 1]
-    NPQI = (R420 - R440) / (R420 + R440 + EPS)
-    save_index_heatmap(NPQI, 'NPQI', fixed_range=(-1.0, 1.0))
-
-    # NDVI = (R800 - R670) / (R800 + R670)  --> normalized difference, fix scale [-1, 1]
-    NDVI = (R800 - R670) / (R800 + R670 + EPS)
-    save_index_heatmap(NDVI, 'NDVI', fixed_range=(-1.0, 1.0))
-
-    # PRI = (R530 - R570) / (R530 + R570)  --> normalized difference, fix scale [-1, 1]
-    PRI = (R530 - R570) / (R530 + R570 + EPS)
-    save_index_heatmap(PRI, 'PRI', fixed_range=(-1.0, 1.0))
-
-    # PSRI = (R680 - R500) / R750
-    PSRI = (R680 - R500) / (R750 + EPS)
-    save_index_heatmap(PSRI, 'PSRI')
-
-    # RENDVI = (R750 - R710) / (R750 + R710)  --> normalized difference, fix scale [-1, 1]
-    RENDVI = (R750 - R710) / (R750 + R710 + EPS)
-    save_index_heatmap(RENDVI, 'RENDVI', fixed_range=(-1.0, 1.0))
-
-    # SRPI = R430 / R680
-    SRPI = R430 / (R680 + EPS)
-    save_index_heatmap(SRPI, 'SRPI')
-
-    # SIPI = (R800 - R450) / (R800 - R680)
-    SIPI = (R800 - R450) / (R800 - R680 + EPS)
-    save_index_heatmap(SIPI, 'SIPI')
-
-    # VREI1 = R740 / R720
-    VREI1 = R740 / (R720 + EPS)
-    save_index_heatmap(VREI1, 'VREI1')
-
-    # VREI2 = (R730 - R750) / (R720 + R730)
-    VREI2 = (R730 - R750) / (R720 + R730 + EPS)
-    save_index_heatmap(VREI2, 'VREI2')
-
-    # WBI = R970 / R900
-    WBI = R970 / (R900 + EPS)
-    save_index_heatmap(WBI, 'WBI')
+    # Now compute all indices (see spectral_indices.py)
+    for name, (formula, fixed_range) in INDICES.items():
+        save_index_heatmap(formula(bands), name, fixed_range=fixed_range)
 
     print(f"Finished folder: {folder}")
+
+
+def main():
+    # Reading the folder list from file
+    with open('folder_list.txt', 'r') as f1:
+        folder_list = [line.strip() for line in f1 if line.strip()]
+
+    folder_number = 0
+
+    # Heatmaps are written in background threads while the next index is computed
+    with ImageWriter() as writer:
+        for folder in folder_list:
+            folder_number += 1
+
+            # Keep the original behavior of skipping the first 3 folders
+            if folder_number < 4:
+                continue
+
+            compute_indexes(folder, writer)
+
+
+if __name__ == '__main__':
+    main()
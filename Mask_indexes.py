@@ -0,0 +1,92 @@
+# This program calculates the statistics of the spectral indices within the masked regions of spectral cubes.
+# All indices registered in spectral_indices.py (the same as in Indexes_auto.py) are calculated from the band images,
+# and each index image is reduced for every mask (masks1.jpg, masks2.jpg ... in <folder>/masks, see Mask_spectra.py)
+# as soon as it is calculated, so no index images are saved or read back.
+# The number of pixels and the mean, SD and quantiles of every index within every mask are saved to
+# 'index_statistics.xlsx', one row per mask. Pixels where an index is not finite are not accounted for.
+# It uses the 'folder_list.txt' file (the first three lines are skipped) and takes 'Corrected_' folders when they exist.
+# Folders are processed in parallel.
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from Mask_spectra import list_masks, resize_mask_to_image
+from spectral_cube import (read_folder_list, resolve_corrected_folder, list_spectral_images, load_grayscale,
+                           bin_spatial, SPATIAL_BIN)
+from spectral_indices import INDICES, REQUIRED_WAVELENGTHS
+
+# ----------------- CONFIG -----------------
+OUTPUT_XLSX = "index_statistics.xlsx"
+QUANTILES = [5, 25, 50, 75, 95]  # percentiles saved for every index
+WORKERS = os.cpu_count()  # folders processed in parallel
+
+
+# ----------------- HELPERS -----------------
+def stat_names() -> list[str]:
+    return ["mean", "sd"] + [f"q{q:02d}" for q in QUANTILES]
+
+
+def index_stats(values: np.ndarray) -> list[float]:
+    """Mean, SD and quantiles of the finite values (NaN if there are none)."""
+    values = values[np.isfinite(values)]
+    if values.size == 0:
+        return [np.nan] * (2 + len(QUANTILES))
+    values = values.astype(np.float64)
+    return [float(values.mean()), float(values.std(ddof=0))] + [float(v) for v in np.percentile(values, QUANTILES)]
+
+
+def folder_index_rows(folder: Path) -> list[dict]:
+    """One row per mask of a folder: {"folder", "mask", "n_pixels", "<stat>_<index>"}."""
+    folder_path = resolve_corrected_folder(folder)
+    mask_files = list_masks(folder_path)
+    if not mask_files:
+        return []
+
+    band_files = dict(list_spectral_images(folder_path))
+    missing = [wl for wl in REQUIRED_WAVELENGTHS if wl not in band_files]
+    if missing:
+        print(f"{folder}: bands {missing} nm needed for the indices not found, folder skipped")
+        return []
+
+    # Load the required bands once, as in Indexes_auto.py
+    bands = {wl: bin_spatial(load_grayscale(band_files[wl]), SPATIAL_BIN).astype(np.float32)
+             for wl in REQUIRED_WAVELENGTHS}
+    H, W = bands[REQUIRED_WAVELENGTHS[0]].shape[:2]
+
+    # Flat pixel positions of every mask
+    pixels = [np.flatnonzero(resize_mask_to_image(load_grayscale(p), H, W)) for p in mask_files]
+    rows = [{"folder": folder.name, "mask": p.name, "n_pixels": len(idx)} for p, idx in zip(mask_files, pixels)]
+
+    # Every index image is reduced for all masks right after it is calculated
+    for name, (formula, _) in INDICES.items():
+        values = formula(bands).ravel()
+        for row, idx in zip(rows, pixels):
+            for stat, value in zip(stat_names(), index_stats(values[idx])):
+                row[f"{stat}_{name}"] = value
+
+    return rows
+
+
+# ----------------- MAIN -----------------
+def main():
+    folders = read_folder_list()
+    print('Index statistics are in progress. Please, wait.')
+
+    rows = []
+    with ProcessPoolExecutor(max_workers=WORKERS) as executor:
+        for folder, folder_rows in zip(folders, executor.map(folder_index_rows, folders)):
+            print(f"Finished folder: {folder}  (masks={len(folder_rows)})")
+            rows.extend(folder_rows)
+
+    columns = ["folder", "mask", "n_pixels"] + [f"{stat}_{name}" for stat in stat_names() for name in INDICES]
+    df = pd.DataFrame(rows, columns=columns)
+    df.to_excel(OUTPUT_XLSX, index=False)
+    print(f"Saved: {OUTPUT_XLSX}  (rows={len(df)}, cols={len(df.columns)})")
+
+
+if __name__ == "__main__":
+    main()
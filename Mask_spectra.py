@@ -0,0 +1,120 @@
+# This program calculates the mean reflectance spectra of the masked regions of spectral cubes.
+# It is the extraction step of 'dot-prompted_segmentation.ipynb' as a program that other programs can call:
+# the masks (masks1.jpg, masks2.jpg ...) drawn in the notebook are taken from <folder>/masks,
+# and the mean and SD of every band within every mask are saved to 'spectral_data.xlsx'.
+# The spectra are cached (see spectrum_cache.py), so after adding masks only the new or changed masks are calculated.
+# It uses the 'folder_list.txt' file (the first three lines are skipped) and takes 'Corrected_' folders when they exist.
+
+import re
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pandas as pd
+
+import spectrum_cache
+from spectral_cube import (read_folder_list, resolve_corrected_folder, list_spectral_images, load_grayscale,
+                           list_products, MASKS_SUBFOLDER)
+
+# ----------------- CONFIG -----------------
+OUTPUT_XLSX = "spectral_data.xlsx"
+
+# Wavelength list: 365, then 400..1000 step 5
+WAVELENGTHS = [365] + list(range(400, 1001, 5))
+
+MASK_RE = re.compile(r"^(masks|mask)(\d+)\.(jpg|jpeg|png)$", re.IGNORECASE)
+
+
+# ----------------- HELPERS -----------------
+def list_masks(folder: Path) -> list[Path]:
+    """List mask files (masksX.jpg/png or maskX.jpg/png) sorted by their numeric suffix."""
+    items = []
+    for f in list_products(folder, MASKS_SUBFOLDER):
+        m = MASK_RE.match(f.name)
+        if m:
+            items.append((int(m.group(2)), f))
+    items.sort(key=lambda t: t[0])
+    return [p for _, p in items]
+
+
+def resize_mask_to_image(mask_small: np.ndarray, target_h: int, target_w: int) -> np.ndarray:
+    mask_resized = cv2.resize(mask_small, (target_w, target_h), interpolation=cv2.INTER_NEAREST)
+    return (mask_resized > 0).astype(np.uint8)
+
+
+def masked_mean_sd(gray_img: np.ndarray, mask01: np.ndarray) -> tuple[float, float] | tuple[None, None]:
+    vals = gray_img[mask01 == 1].astype(np.float64)
+    if vals.size == 0:
+        return None, None
+    return float(vals.mean()), float(vals.std(ddof=0))
+
+
+def folder_mask_rows(folder_name: str, folder_path: Path) -> list[dict]:
+    """
+    One row per mask of a folder: {"folder", "mask", "mean_<wl>", "sd_<wl>"}.
+    The masks found in the cache are not calculated again; for the others,
+    every band image is decoded once and reduced for all of them.
+    """
+    mask_files = list_masks(folder_path)
+    if not mask_files:
+        return []
+
+    cube = spectrum_cache.cube_checksum(folder_path)
+    keys = [spectrum_cache.make_key("mask", cube, spectrum_cache.file_checksum(p), WAVELENGTHS) for p in mask_files]
+    values = [spectrum_cache.get(key) for key in keys]
+    todo = [i for i, value in enumerate(values) if value is None]
+
+    if todo:
+        masks_small = [load_grayscale(mask_files[i]) for i in todo]
+        computed = [{} for _ in todo]
+        band_files = dict(list_spectral_images(folder_path))
+
+        for wl in WAVELENGTHS:
+            if wl not in band_files:
+                for value in computed:
+                    value[f"mean_{wl}"] = np.nan
+                    value[f"sd_{wl}"] = np.nan
+                continue
+
+            gray = load_grayscale(band_files[wl])
+            H, W = gray.shape[:2]
+            for value, mask_small in zip(computed, masks_small):
+                mean, sd = masked_mean_sd(gray, resize_mask_to_image(mask_small, H, W))
+                value[f"mean_{wl}"] = np.nan if mean is None else mean
+                value[f"sd_{wl}"] = np.nan if sd is None else sd
+
+        for i, value in zip(todo, computed):
+            values[i] = value
+            spectrum_cache.put(keys[i], value)
+
+    return [{"folder": folder_name, "mask": p.name, **value} for p, value in zip(mask_files, values)]
+
+
+def rows_to_table(rows: list[dict]) -> pd.DataFrame:
+    """Stable column order; all-NA wavelength columns dropped and remaining NaNs written as 'NA'."""
+    mean_cols = [f"mean_{wl}" for wl in WAVELENGTHS]
+    sd_cols = [f"sd_{wl}" for wl in WAVELENGTHS]
+    df = pd.DataFrame(rows, columns=["folder", "mask"] + mean_cols + sd_cols)
+
+    keep_base = ["folder", "mask"]
+    data_cols = [c for c in df.columns if c not in keep_base]
+    df_clean = pd.concat([df[keep_base], df[data_cols].dropna(axis=1, how="all")], axis=1)
+    return df_clean.fillna("NA")
+
+
+# ----------------- MAIN -----------------
+def main():
+    rows = []
+    for folder in read_folder_list():
+        folder_path = resolve_corrected_folder(folder)
+        rows.extend(folder_mask_rows(folder.name, folder_path))
+
+    spectrum_cache.evict()
+
+    df_clean = rows_to_table(rows)
+    df_clean.to_excel(OUTPUT_XLSX, index=False)
+    print(f"Saved: {OUTPUT_XLSX}  (rows={len(df_clean)}, cols={len(df_clean.columns)})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+# This program builds master dark current and flat field frames from repeated captures.
+# A single Dark_current or Flat_field capture carries its sensor noise into every corrected image,
+# so it is better to take several captures of each and to average them.
+# The base names are taken from lines 2 and 3 of 'folder_list.txt' (the same file used by image_correction.py).
+# Every folder whose name starts with the base name is treated as a repeated capture, e.g.:
+# 23.01.2024_Dark_current, 23.01.2024_Dark_current_2, 23.01.2024_Dark_current_3 ...
+# The master frames are written as float32 arrays to 'Master_<base name>/Spectral_Cube/image<wavelength>.npy'.
+# image_correction.py uses them automatically instead of the single captures when they exist.
+#
+# The captures are combined band by band with running accumulators, so memory does not depend
+# on the number of captures. With METHOD = 'sigma_clip', a pixel value is excluded when it deviates more than
+# SIGMA standard deviations from the mean of the same pixel in the other captures (a second pass over the captures).
+# The other captures are used because an outlier inflates the SD of a sample that includes it: with N captures,
+# no value can be more than sqrt(N - 1) SDs from their common mean, so nothing would be excluded for N <= 10.
+# Bands are processed in parallel.
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from spectral_cube import SPECTRAL_SUBFOLDER, list_spectral_images, load_grayscale
+
+# ----------------- CONFIG -----------------
+FOLDER_LIST_FILE = 'folder_list.txt'
+METHOD = 'sigma_clip'  # 'mean' or 'sigma_clip'
+SIGMA = 3.0  # clipping threshold in standard deviations
+MIN_SD = 1.0  # the SD is taken as at least one 8-bit step, so equal captures do not exclude a value one step off
+WORKERS = os.cpu_count()  # bands processed in parallel
+
+MASTER_PREFIX = 'Master_'
+
+
+def find_captures(base_name: str) -> list[Path]:
+    """Folders next to base_name whose names start with it and that hold a spectral cube."""
+    base = Path(base_name)
+    parent = base.parent
+    captures = []
+    for entry in sorted(os.scandir(parent), key=lambda e: e.name):
+        if entry.is_dir() and entry.name.startswith(base.name) and (Path(entry.path) / SPECTRAL_SUBFOLDER).is_dir():
+            captures.append(parent / entry.name)
+    return captures
+
+
+def combine_band(paths: list[Path]) -> np.ndarray:
+    """Mean (or sigma-clipped mean) of one band over all captures, streaming one capture at a time."""
+    # First pass: sums of the values and of their squares (exact in float64 for 8-bit images)
+    count = 0
+    total = None
+    total_sq = None
+    for path in paths:
+        img = load_grayscale(path).astype(np.float64)
+        count += 1
+        if total is None:
+            total = img.copy()
+            total_sq = img * img
+            continue
+        total += img
+        total_sq += img * img
+    mean = total / count
+
+    if METHOD == 'mean' or count < 3:
+        return mean.astype(np.float32)
+
+    # Second pass: average only the values within SIGMA standard deviations of the other captures (leave-one-out)
+    others = count - 1
+    clipped_sum = np.zeros_like(mean)
+    clipped_count = np.zeros_like(mean)
+    for path in paths:
+        img = load_grayscale(path).astype(np.float64)
+        mean_others = (total - img) / others
+        sd_others = np.sqrt(np.maximum((total_sq - img * img) / others - mean_others ** 2, 0.0))
+        keep = np.abs(img - mean_others) <= SIGMA * np.maximum(sd_others, MIN_SD)
+        clipped_sum += np.where(keep, img, 0.0)
+        clipped_count += keep
+    master = np.where(clipped_count > 0, clipped_sum / np.maximum(clipped_count, 1), mean)
+    return master.astype(np.float32)
+
+
+def build_master(base_name: str) -> None:
+    captures = find_captures(base_name)
+    if not captures:
+        print('No captures found for <' + base_name + '>')
+        return
+    print(f'{base_name}: combining {len(captures)} captures ({METHOD})')
+
+    band_files = [dict(list_spectral_images(capture)) for capture in captures]
+    waves = sorted(set.intersection(*(set(files) for files in band_files)))
+    out_folder = Path(base_name).parent / (MASTER_PREFIX + Path(base_name).name) / SPECTRAL_SUBFOLDER
+    os.makedirs(out_folder, exist_ok=True)
+
+    def process(wave_length):
+        master = combine_band([files[wave_length] for files in band_files])
+        np.save(out_folder / f'image{wave_length}.npy', master)
+        return wave_length
+
+    with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+        for wave_length in executor.map(process, waves):
+            print(f'\r{wave_length} nm is ready', end='')
+    print('\rSaved: ' + str(out_folder))
+
+
+def main():
+    with open(FOLDER_LIST_FILE, 'r') as f1:
+        folder_list = [line.strip() for line in f1]
+
+    # Lines 2 and 3 hold the Dark_current and Flat_field folders
+    for base_name in folder_list[1:3]:
+        if base_name:
+            build_master(base_name)
+
+    print('Ready')
+
+
+if __name__ == '__main__':
+    main()
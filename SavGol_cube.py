@@ -0,0 +1,95 @@
+# This program applies the Savitzky–Golay filter along the spectral axis of every pixel of the spectral cube.
+# Unlike Savitzky–Golay.py, which smooths the averaged spectra in 'spectrum.xlsx', it smooths the whole cube,
+# so that index images, PCA and clustering can be computed on smoothed bands.
+# It uses the 'folder_list.txt' file (the first three lines are skipped) and takes 'Corrected_' folders when they exist.
+# The cube is processed in horizontal tiles with one vectorized filter per tile, so memory stays bounded.
+# The smoothed cube is written to 'SavGol_<folder>/Spectral_Cube' as PNG images that other programs can read
+# (put 'SavGol_<folder>' into 'folder_list.txt' to use it).
+# Optionally, the first and/or second derivatives are written to 'SavGol_<folder>/Derivative_<n>.npy'
+# as float32 arrays of shape (bands, height, width), bands in the same order as in 'Spectral_Cube'.
+# Note: the bands are treated as equally spaced, as Savitzky–Golay.py does for the 365 nm band; the derivatives are
+# scaled by the median step between the bands (5 nm, or the bin width when spectral binning is on).
+
+import os
+import tempfile
+
+import numpy as np
+from scipy.signal import savgol_filter
+
+import catalog
+from image_writer import ImageWriter
+from spectral_cube import read_folder_list, resolve_corrected_folder, open_cube, iter_tiles, SPECTRAL_SUBFOLDER
+
+# ----------------- CONFIG -----------------
+WINDOW_SIZE = 11  # number of bands in the filter window
+POLY_ORDER = 3
+DERIVATIVES = [1]  # derivative cubes to write, e.g. [], [1] or [1, 2]
+TILE_ROWS = 64  # image rows per tile
+
+OUTPUT_PREFIX = 'SavGol_'
+
+
+def smooth_folder(folder):
+    """Write the smoothed cube (and the derivative cubes) of one folder."""
+    out_folder = folder.parent / (OUTPUT_PREFIX + folder.name)
+    out_cube_folder = out_folder / SPECTRAL_SUBFOLDER
+
+    with open_cube(folder) as (waves, cube), tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as tmp:
+        n_bands = cube.shape[0]
+        window = min(WINDOW_SIZE, n_bands)
+        if window % 2 == 0:
+            window -= 1  # the window must be odd
+        if window <= POLY_ORDER:
+            raise ValueError(f"{folder}: {n_bands} bands give a window of {window} bands, "
+                             f"too small for polynomial order {POLY_ORDER}")
+        band_step = float(np.median(np.diff(waves))) if n_bands > 1 else 1.0  # nm, scales the derivatives
+        os.makedirs(out_cube_folder, exist_ok=True)
+
+        smoothed = np.lib.format.open_memmap(os.path.join(tmp, 'smoothed.npy'), mode='w+', dtype=np.uint8,
+                                             shape=cube.shape)
+        derivatives = {}
+        for deriv in DERIVATIVES:
+            derivatives[deriv] = np.lib.format.open_memmap(str(out_folder / f'Derivative_{deriv}.npy'), mode='w+',
+                                                           dtype=np.float32, shape=cube.shape)
+
+        for r0, r1, tile in iter_tiles(cube, TILE_ROWS):
+            tile = tile.astype(np.float32)
+            smooth_tile = savgol_filter(tile, window, POLY_ORDER, axis=0)
+            smoothed[:, r0:r1, :] = np.clip(np.rint(smooth_tile), 0, 255).astype(np.uint8)
+            for deriv, out in derivatives.items():
+                out[:, r0:r1, :] = savgol_filter(tile, window, POLY_ORDER, deriv=deriv, delta=band_step, axis=0)
+            print(f'\r{folder.name}: rows {r1}/{cube.shape[1]}', end='')
+        print('\r', end='')
+
+        for out in derivatives.values():
+            out.flush()
+        del derivatives
+
+        # Write the smoothed bands as lossless images in background threads
+        with ImageWriter() as writer:
+            for i, wl in enumerate(waves):
+                writer.imwrite(out_cube_folder / f'image{wl}.png', np.array(smoothed[i]))
+        del smoothed
+
+    # Register the smoothed cube in the catalog (its bands may have been overwritten in place)
+    catalog.update_folder(catalog.default_connection(), out_folder, force=True)
+    return out_folder
+
+
+def main():
+    print('This program applies Savitzky–Golay filter along the spectral axis of every pixel.')
+    print(f'Window size: {WINDOW_SIZE}, polynomial order: {POLY_ORDER}, derivatives: {DERIVATIVES}')
+    for folder in read_folder_list():
+        folder = resolve_corrected_folder(folder)
+        if not folder.is_dir():
+            print('A folder <' + str(folder) + '> not found!')
+            continue
+        print('Smoothing of ' + str(folder) + ' is in progress')
+        out_folder = smooth_folder(folder)
+        print('Saved: ' + str(out_folder))
+
+    print('Done!')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+# This program watches the common folder for new spectral cubes written by the MUSES9-HS software
+# and processes them automatically, so that the results are ready a few minutes after capture.
+# Run it from the common folder (the one with 'folder_list.txt') and leave it running; press Ctrl+C to stop.
+#
+# A new folder is processed when its 'Spectral_Cube' holds all bands and its files have not changed
+# for SETTLE_SECONDS (the camera software writes the bands one by one). Then, in the background:
+# 1) correction, as in image_correction.py, if the spectralon spectrum was saved by an interactive run
+#    of image_correction.py ('spectralon_spectrum.csv') and the Dark_current and Flat_field folders
+#    from lines 2 and 3 of 'folder_list.txt' exist;
+# 2) index images, as in Indexes_auto.py;
+# 3) mask spectra, as in Mask_spectra.py, if the folder has masks. They are saved to <folder>/spectral_data.xlsx
+#    and calculated again whenever masks are added.
+# The folders from lines 1-3 of 'folder_list.txt' (and their repeated captures) are not processed.
+# The processed folders are remembered in 'watch_state.json', so the program can be restarted.
+
+import hashlib
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import catalog
+import image_correction
+import Indexes_auto
+import Mask_spectra
+from image_writer import ImageWriter
+from spectral_cube import (IMG_RE, SPECTRAL_SUBFOLDER, MASKS_SUBFOLDER, band_extension, resolve_corrected_folder,
+                           read_reference_folders)
+
+# ----------------- CONFIG -----------------
+POLL_SECONDS = 10  # how often the common folder is checked
+SETTLE_SECONDS = 30  # the files of a cube must be unchanged for this time
+EXPECTED_WAVELENGTHS = [365] + list(range(400, 1001, 5))
+STATE_FILE = 'watch_state.json'
+SKIP_PREFIXES = ('Corrected_', 'Master_', 'SavGol_')  # folders made by the programs
+
+
+def cube_snapshot(folder: str) -> tuple[set[int], str]:
+    """The wavelengths present in a Spectral_Cube and a signature of its files (names, sizes, times)."""
+    waves = set()
+    files = []
+    for entry in os.scandir(os.path.join(folder, SPECTRAL_SUBFOLDER)):
+        m = IMG_RE.match(entry.name)
+        if m and entry.is_file():
+            st = entry.stat()
+            waves.add(int(m.group(1)))
+            files.append((entry.name, st.st_size, st.st_mtime))
+    return waves, hashlib.sha1(json.dumps(sorted(files)).encode()).hexdigest()
+
+
+def masks_signature(folder: str) -> float | None:
+    path = os.path.join(str(resolve_corrected_folder(Path(folder))), MASKS_SUBFOLDER)
+    return os.stat(path).st_mtime if os.path.isdir(path) else None
+
+
+def candidate_folders(references: list[str]) -> list[str]:
+    folders = []
+    for entry in os.scandir('.'):
+        name = entry.name
+        if not entry.is_dir() or name.startswith(SKIP_PREFIXES):
+            continue
+        if any(ref and name.startswith(ref) for ref in references):
+            continue
+        if os.path.isdir(os.path.join(name, SPECTRAL_SUBFOLDER)):
+            folders.append(name)
+    return sorted(folders)
+
+
+def correct(folder: str, references: list[str], writer: ImageWriter) -> None:
+    _, dark_folder, flat_folder = references
+    if not os.path.exists(image_correction.SPECTRALON_SPECTRUM_FILE):
+        print(f'{folder}: no {image_correction.SPECTRALON_SPECTRUM_FILE} (run image_correction.py once), '
+              f'correction skipped')
+        return
+    if not (dark_folder and flat_folder and os.path.isdir(dark_folder) and os.path.isdir(flat_folder)):
+        print(f'{folder}: Dark_current or Flat_field folder not found, correction skipped')
+        return
+
+    spectrum = image_correction.load_spectralon_spectrum()
+    output_folder = 'Corrected_' + folder + '/Spectral_Cube/'
+    os.makedirs(output_folder, exist_ok=True)
+    print(f'{folder}: correction is in progress')
+    image_correction.correct_folder(folder + '/Spectral_Cube/', output_folder, dark_folder + '/Spectral_Cube/',
+                                    flat_folder + '/Spectral_Cube/', spectrum, '.' + band_extension(Path(folder)),
+                                    writer, show=False)
+    writer.flush()
+    catalog.update_folder(catalog.default_connection(), 'Corrected_' + folder, force=True)
+
+
+def extract_mask_spectra(folder: str) -> None:
+    folder_path = resolve_corrected_folder(Path(folder))
+    rows = Mask_spectra.folder_mask_rows(folder, folder_path)
+    if not rows:
+        return
+    out_path = folder_path / Mask_spectra.OUTPUT_XLSX
+    Mask_spectra.rows_to_table(rows).to_excel(out_path, index=False)
+    print(f'{folder}: saved {out_path}')
+
+
+def process_folder(folder: str, references: list[str], cube_done: bool) -> float | None:
+    """
+    Run the processing stages of one folder; the cube stages are skipped if they were already done.
+    Returns the signature of the masks that were processed.
+    """
+    with ImageWriter() as writer:
+        if not cube_done:
+            correct(folder, references, writer)
+            Indexes_auto.compute_indexes(folder, writer)
+            writer.flush()
+        extract_mask_spectra(folder)
+    catalog.invalidate(folder)
+    catalog.invalidate(resolve_corrected_folder(Path(folder)))
+    return masks_signature(folder)
+
+
+def main():
+    state = {}
+    if os.path.exists(STATE_FILE):
+        with open(STATE_FILE, 'r') as f:
+            state = json.load(f)
+
+    references = read_reference_folders()
+    seen = {}  # folder -> (cube signature, time when it last changed)
+    running = {}  # folder -> future
+    print('Watching ' + os.getcwd() + ' for new spectral cubes. Press Ctrl+C to stop.')
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        try:
+            while True:
+                now = time.time()
+
+                # Collect the finished jobs
+                for folder, (future, cube_signature) in list(running.items()):
+                    if not future.done():
+                        continue
+                    del running[folder]
+                    try:
+                        masks = future.result()
+                        state[folder] = {'cube': cube_signature, 'masks': masks}
+                        with open(STATE_FILE, 'w') as f:
+                            json.dump(state, f, indent=1)
+                        print(f'{folder}: ready')
+                    except Exception:
+                        print(f'{folder}: processing failed')
+                        traceback.print_exc()
+
+                for folder in candidate_folders(references):
+                    if folder in running:
+                        continue
+                    waves, cube_signature = cube_snapshot(folder)
+                    if not set(EXPECTED_WAVELENGTHS) <= waves:
+                        continue  # the cube is still being written
+
+                    # Debounce: wait until the files stop changing
+                    if folder not in seen or seen[folder][0] != cube_signature:
+                        seen[folder] = (cube_signature, now)
+                        continue
+                    if now - seen[folder][1] < SETTLE_SECONDS:
+                        continue
+
+                    done = state.get(folder, {})
+                    cube_done = done.get('cube') == cube_signature
+                    masks = masks_signature(folder)
+                    if cube_done and done.get('masks') == masks:
+                        continue
+
+                    print(f'{folder}: queued')
+                    future = executor.submit(process_folder, folder, references, cube_done)
+                    running[folder] = (future, cube_signature)
+
+                time.sleep(POLL_SECONDS)
+        except KeyboardInterrupt:
+            print('Stopping after the current folder.')
+            for future, _ in running.values():
+                future.cancel()
+
+
+if __name__ == '__main__':
+    main()
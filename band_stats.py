@@ -0,0 +1,104 @@
+# Statistics of every band of a spectral cube, calculated once and stored with the cube.
+# For each band, the sidecar file <folder>/band_stats.json holds the histogram (256 bins of the 8-bit values),
+# min, max, mean, SD and the percentiles PERCENTILES, all calculated in one parallel pass over the band images.
+# The sidecar carries the checksum of the cube (spectral_cube.cube_checksum); when the cube changes,
+# the checksum changes and the statistics are calculated again on the next use.
+# The programs take the distribution of the band values from here instead of scanning the pixels again
+# (e.g. HYPER-S.py can scale the displayed band by its 1st and 99th percentiles).
+#
+# To calculate the statistics of all acquisition folders in the current directory (or in the given folders), run:
+#   python band_stats.py [folder ...]
+
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from spectral_cube import SPECTRAL_SUBFOLDER, list_spectral_images, load_grayscale, cube_checksum
+
+# ----------------- CONFIG -----------------
+SIDECAR_FILE = "band_stats.json"
+PERCENTILES = [1, 5, 25, 50, 75, 95, 99]
+WORKERS = os.cpu_count()  # bands processed in parallel
+
+
+# ----------------- HELPERS -----------------
+def histogram_stats(hist: np.ndarray) -> dict:
+    """Min, max, mean, SD and percentiles of 8-bit values from their histogram (exact, no pixels needed)."""
+    values = np.arange(len(hist))
+    n = hist.sum()
+    nonzero = np.flatnonzero(hist)
+    mean = float((values * hist).sum() / n)
+    sd = float(np.sqrt(((values - mean) ** 2 * hist).sum() / n))
+    # The same values as np.percentile(pixels, q, method='inverted_cdf')
+    cdf = np.cumsum(hist)
+    percentiles = {str(q): int(np.searchsorted(cdf, q / 100 * n)) for q in PERCENTILES}
+    return {"min": int(nonzero[0]), "max": int(nonzero[-1]), "mean": mean, "sd": sd, "percentiles": percentiles,
+            "histogram": hist.tolist()}
+
+
+def band_histogram(path: Path) -> np.ndarray:
+    return np.bincount(load_grayscale(path).ravel(), minlength=256)
+
+
+def compute_band_stats(folder) -> dict:
+    """Statistics of all bands of a folder in one parallel pass: {wavelength (str): {...}}."""
+    bands = list_spectral_images(Path(folder))
+    with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+        histograms = list(executor.map(band_histogram, [path for _, path in bands]))
+    return {str(wl): histogram_stats(hist) for (wl, _), hist in zip(bands, histograms)}
+
+
+def load_band_stats(folder) -> dict:
+    """
+    Statistics of all bands of a folder, {wavelength (int): {...}}.
+    They are read from the sidecar file, or calculated and saved if the cube has changed since.
+    """
+    checksum = cube_checksum(Path(folder))
+    if checksum is None:
+        return {}
+    sidecar = Path(folder) / SIDECAR_FILE
+    stats = None
+    try:
+        with open(sidecar, "r") as f:
+            saved = json.load(f)
+        if saved.get("checksum") == checksum:
+            stats = saved["bands"]
+    except (OSError, ValueError):
+        pass
+
+    if stats is None:
+        stats = compute_band_stats(folder)
+        tmp = sidecar.with_name(f"{SIDECAR_FILE}.{os.getpid()}.tmp")
+        with open(tmp, "w") as f:
+            json.dump({"checksum": checksum, "bands": stats}, f)
+        os.replace(tmp, sidecar)
+    return {int(wl): values for wl, values in stats.items()}
+
+
+def stretch(image: np.ndarray, band: dict, low: int = 1, high: int = 99) -> np.ndarray:
+    """Scale an 8-bit image of a band so that its low..high percentiles fill the range 0..255."""
+    vmin = band["percentiles"][str(low)]
+    vmax = band["percentiles"][str(high)]
+    if vmax <= vmin:
+        return image
+    lut = np.clip((np.arange(256) - vmin) * 255.0 / (vmax - vmin), 0, 255).astype(np.uint8)
+    return lut[image]
+
+
+# ----------------- MAIN -----------------
+def main():
+    folders = sys.argv[1:]
+    if not folders:
+        folders = sorted(entry.name for entry in os.scandir(".")
+                         if entry.is_dir() and os.path.isdir(os.path.join(entry.path, SPECTRAL_SUBFOLDER)))
+    for folder in folders:
+        stats = load_band_stats(folder)
+        print(f"{folder}: statistics of {len(stats)} bands are ready")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+# SQLite catalog of acquisition folders.
+# For every folder with a 'Spectral_Cube' subfolder, the catalog stores the band list, file extension,
+# image dimensions, bit depth, checksums of the band images, correction status (the 'Corrected_' sibling),
+# and the masks and derived products (Indexes_out, PCA-Out, Clusters_out, ...).
+# The programs resolve folders and bands through this catalog instead of listing the directories.
+# A folder is validated with a few stat calls (the folder, its subfolders and its 'Corrected_' sibling)
+# and re-scanned only when one of their modification times changes.
+# The checksums are calculated only when a program asks for them (cube_checksum): the sizes and modification
+# times of the band images are then checked (a band overwritten in place does not change the folder times),
+# and only the changed images are hashed again.
+#
+# To index all acquisition folders in the current directory (or in the given directories), run:
+#   python catalog.py [root ...]
+
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from pathlib import Path
+
+import cv2
+
+from spectral_cube import IMG_RE, SPECTRAL_SUBFOLDER, MASKS_SUBFOLDER, file_checksum
+
+# ----------------- CONFIG -----------------
+CATALOG_FILE = "catalog.sqlite"
+
+# Subfolders of an acquisition folder holding masks and derived products
+PRODUCT_SUBFOLDERS = [MASKS_SUBFOLDER, "Indexes_out", "Indexes_out_fluorescence", "PCA-Out", "Clusters_out"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS folders (
+    path TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    extension TEXT,
+    n_bands INTEGER,
+    width INTEGER,
+    height INTEGER,
+    bit_depth INTEGER,
+    channels INTEGER,
+    checksum TEXT,
+    corrected INTEGER NOT NULL,
+    corrected_path TEXT,
+    signature TEXT,
+    cube_mtime REAL,
+    scanned_at REAL
+);
+CREATE TABLE IF NOT EXISTS bands (
+    folder TEXT NOT NULL,
+    wavelength INTEGER NOT NULL,
+    file TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    checksum TEXT NOT NULL,
+    PRIMARY KEY (folder, wavelength)
+);
+CREATE TABLE IF NOT EXISTS products (
+    folder TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    file TEXT NOT NULL,
+    PRIMARY KEY (folder, file)
+);
+"""
+
+_local = threading.local()  # one connection per thread
+_checked = set()  # folders already validated by this process
+
+
+# ----------------- HELPERS -----------------
+def connect(path: str = CATALOG_FILE) -> sqlite3.Connection:
+    """Open (and create if needed) the catalog database."""
+    conn = sqlite3.connect(path, timeout=60)
+    conn.row_factory = sqlite3.Row
+    # Rollback journal (not WAL), as WAL does not work on network file systems (the common folder may be shared);
+    # set explicitly, so that catalogs created in WAL mode are switched back
+    conn.execute("PRAGMA journal_mode=DELETE")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def default_connection() -> sqlite3.Connection:
+    """The catalog in the current directory, opened once per thread."""
+    if getattr(_local, "connection", None) is None:
+        _local.connection = connect()
+    return _local.connection
+
+
+def folder_key(folder) -> str:
+    """The path a folder is stored under (absolute, symbolic links are kept as they are)."""
+    return os.path.abspath(folder)
+
+
+def _mtime(path) -> float | None:
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def folder_signature(folder: Path) -> str:
+    """Modification times of the folder, its subfolders and its 'Corrected_' sibling (a handful of stat calls)."""
+    # The 'Corrected_' sibling is included, as creating it does not change the times of this folder
+    corrected_sibling = Path(folder_key(folder)).parent / f"Corrected_{Path(folder_key(folder)).name}"
+    paths = [folder, folder / SPECTRAL_SUBFOLDER, corrected_sibling] + [folder / sub for sub in PRODUCT_SUBFOLDERS]
+    return json.dumps([_mtime(p) for p in paths])
+
+
+def _scan_bands(conn: sqlite3.Connection, key: str, spectral: Path, rehash: bool = False) -> None:
+    """
+    Update the band rows of a folder. The checksums of the files that changed are cleared ('')
+    or, with rehash, calculated together with the ones not calculated yet.
+    """
+    known = {row["file"]: row for row in conn.execute("SELECT * FROM bands WHERE folder = ?", (key,))}
+    found = {}
+    for entry in os.scandir(spectral):
+        m = IMG_RE.match(entry.name)
+        if not m or not entry.is_file():
+            continue
+        st = entry.stat()
+        row = known.get(entry.name)
+        checksum = ""
+        if row is not None and row["size"] == st.st_size and row["mtime"] == st.st_mtime:
+            checksum = row["checksum"]
+        if rehash and not checksum:
+            checksum = file_checksum(Path(entry.path))
+        found[int(m.group(1))] = (entry.name, st.st_size, st.st_mtime, checksum)
+
+    conn.execute("DELETE FROM bands WHERE folder = ?", (key,))
+    conn.executemany("INSERT INTO bands VALUES (?, ?, ?, ?, ?, ?)",
+                     [(key, wl, *values) for wl, values in found.items()])
+
+
+def _combined_checksum(conn: sqlite3.Connection, key: str) -> str | None:
+    """Checksum of the cube from the band checksums; None if some of them are not calculated yet."""
+    bands = conn.execute("SELECT wavelength, checksum FROM bands WHERE folder = ? ORDER BY wavelength",
+                         (key,)).fetchall()
+    if not bands or not all(b["checksum"] for b in bands):
+        return None
+    return hashlib.sha1("".join(f"{b['wavelength']}:{b['checksum']};" for b in bands).encode()).hexdigest()
+
+
+def _scan_products(conn: sqlite3.Connection, key: str, folder: Path) -> None:
+    conn.execute("DELETE FROM products WHERE folder = ?", (key,))
+    rows = []
+    for sub in PRODUCT_SUBFOLDERS:
+        sub_dir = folder / sub
+        if not sub_dir.is_dir():
+            continue
+        for entry in os.scandir(sub_dir):
+            if entry.is_file():
+                rows.append((key, sub, os.path.join(sub, entry.name)))
+    conn.executemany("INSERT INTO products VALUES (?, ?, ?)", rows)
+
+
+def _drop_folder(conn: sqlite3.Connection, key: str) -> None:
+    """Remove a folder from the catalog, and from the original folder if it was its corrected copy."""
+    for table, column in (("folders", "path"), ("bands", "folder"), ("products", "folder")):
+        conn.execute(f"DELETE FROM {table} WHERE {column} = ?", (key,))
+    conn.execute("UPDATE folders SET corrected_path = NULL WHERE corrected_path = ?", (key,))
+
+
+def update_folder(conn: sqlite3.Connection, folder, force: bool = False) -> sqlite3.Row | None:
+    """
+    Bring the catalog entry of one folder up to date and return it.
+    Returns None if the folder has no 'Spectral_Cube' subfolder.
+    """
+    folder = Path(folder)
+    key = folder_key(folder)
+    spectral = folder / SPECTRAL_SUBFOLDER
+    row = conn.execute("SELECT * FROM folders WHERE path = ?", (key,)).fetchone()
+
+    if not spectral.is_dir():
+        if row is not None:
+            with conn:
+                _drop_folder(conn, key)
+        return None
+
+    signature = folder_signature(folder)
+    if row is not None and row["signature"] == signature and not force:
+        return row
+
+    name = Path(key).name
+    corrected = name.startswith("Corrected_")
+    corrected_sibling = Path(key).parent / f"Corrected_{name}"
+    corrected_path = None if corrected or not corrected_sibling.is_dir() else folder_key(corrected_sibling)
+
+    with conn:
+        cube_mtime = _mtime(spectral)
+        _scan_bands(conn, key, spectral)  # the checksums of the changed images are calculated when asked for
+        _scan_products(conn, key, folder)
+
+        bands = conn.execute("SELECT wavelength, file FROM bands WHERE folder = ? ORDER BY wavelength",
+                             (key,)).fetchall()
+        extension = width = height = bit_depth = channels = None
+        if bands:
+            extensions = [os.path.splitext(b["file"])[1].lower().lstrip(".") for b in bands]
+            extension = max(set(extensions), key=extensions.count)
+            img = cv2.imread(str(spectral / bands[-1]["file"]), cv2.IMREAD_UNCHANGED)
+            if img is not None:
+                height, width = img.shape[:2]
+                channels = 1 if img.ndim == 2 else img.shape[2]
+                bit_depth = img.dtype.itemsize * 8
+        checksum = _combined_checksum(conn, key)
+
+        conn.execute("INSERT OR REPLACE INTO folders VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                     (key, name, extension, len(bands), width, height, bit_depth, channels, checksum,
+                      int(corrected), corrected_path, signature, cube_mtime, time.time()))
+        if corrected:
+            # Let the original folder know about its corrected copy
+            original = folder_key(Path(key).parent / name[len("Corrected_"):])
+            conn.execute("UPDATE folders SET corrected_path = ? WHERE path = ?", (key, original))
+
+    return conn.execute("SELECT * FROM folders WHERE path = ?", (key,)).fetchone()
+
+
+def update_root(conn: sqlite3.Connection, root=".", force: bool = False) -> list[sqlite3.Row]:
+    """Index every acquisition folder directly inside root."""
+    rows = []
+    for entry in sorted(os.scandir(root), key=lambda e: e.name):
+        if entry.is_dir() and os.path.isdir(os.path.join(entry.path, SPECTRAL_SUBFOLDER)):
+            rows.append(update_folder(conn, entry.path, force))
+    # Drop the folders that no longer exist
+    with conn:
+        for row in conn.execute("SELECT path FROM folders").fetchall():
+            if not os.path.isdir(os.path.join(row["path"], SPECTRAL_SUBFOLDER)):
+                _drop_folder(conn, row["path"])
+    return rows
+
+
+def folder_info(folder) -> sqlite3.Row | None:
+    """
+    Catalog entry of a folder. The entry is validated against the folder signature
+    once per process; after that it is served from the database.
+    """
+    conn = default_connection()
+    key = folder_key(folder)
+    if key not in _checked:
+        _checked.add(key)
+        return update_folder(conn, folder)
+    row = conn.execute("SELECT * FROM folders WHERE path = ?", (key,)).fetchone()
+    return row if row is not None else update_folder(conn, folder)
+
+
+def band_paths(folder) -> list[tuple[int, Path]]:
+    """(wavelength, path) pairs of the band images of a folder, sorted by wavelength."""
+    info = folder_info(folder)
+    if info is None:
+        return []
+    spectral = Path(folder) / SPECTRAL_SUBFOLDER
+    rows = default_connection().execute(
+        "SELECT wavelength, file FROM bands WHERE folder = ? ORDER BY wavelength", (info["path"],))
+    return [(row["wavelength"], spectral / row["file"]) for row in rows]
+
+
+def list_products(folder, kind: str) -> list[Path]:
+    """Files of one product subfolder (e.g. 'masks' or 'Indexes_out') of a folder."""
+    info = folder_info(folder)
+    if info is None:
+        return []
+    rows = default_connection().execute(
+        "SELECT file FROM products WHERE folder = ? AND kind = ? ORDER BY file", (info["path"], kind))
+    return [Path(folder) / row["file"] for row in rows]
+
+
+def cube_checksum(folder) -> str | None:
+    """
+    Checksum of all band images of a folder (None if there are none). The sizes and modification times
+    of the band images are checked on every call, and only the changed images are hashed again.
+    """
+    info = folder_info(folder)
+    if info is None:
+        return None
+    conn = default_connection()
+    with conn:
+        _scan_bands(conn, info["path"], Path(folder) / SPECTRAL_SUBFOLDER, rehash=True)
+        checksum = _combined_checksum(conn, info["path"])
+        conn.execute("UPDATE folders SET checksum = ? WHERE path = ?", (checksum, info["path"]))
+    return checksum
+
+
+def invalidate(folder) -> None:
+    """Force the next lookup of a folder to re-validate it (call after writing into the folder)."""
+    _checked.discard(folder_key(folder))
+
+
+def main():
+    roots = sys.argv[1:] or ["."]
+    conn = connect()
+    for root in roots:
+        print(f"Indexing acquisitions in {root}")
+        for row in update_root(conn, root):
+            cube_checksum(row["path"])  # calculated in advance for the programs that need it
+            status = "corrected" if row["corrected"] else ("has corrected copy" if row["corrected_path"] else "raw")
+            print(f"  {row['name']}: {row['n_bands']} bands, {row['width']}x{row['height']}, "
+                  f"{row['bit_depth']}-bit .{row['extension']}, {status}")
+    total = conn.execute("SELECT COUNT(*) FROM folders").fetchone()[0]
+    print(f"Catalog {CATALOG_FILE} holds {total} folders.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# Background writer of output images, shared by the programs that save many images
+# (image_correction.py, Indexes_auto.py, HS-PCA.py, Gather_indexes.py).
+# Images are put into a bounded queue and written by a pool of threads, so that JPEG/PNG encoding
+# and disk I/O overlap with the computation of the next band or index (cv2.imwrite releases the GIL).
+# When the queue is full, the program waits, so no more than MAX_PENDING images are held in memory.
+# Errors are collected and raised by flush() or close() at the end of the run.
+#
+# Usage (the queued images are also written when the program stops with an error):
+#   with ImageWriter() as writer:
+#       writer.imwrite(path, image)  # the image must not be modified afterwards
+
+import os
+import queue
+import shutil
+import threading
+
+import cv2
+
+# ----------------- CONFIG -----------------
+WORKERS = min(4, os.cpu_count() or 1)  # writer threads
+MAX_PENDING = 16  # images waiting in the queue
+
+
+class ImageWriter:
+    """A bounded queue of write tasks drained by a pool of threads."""
+
+    def __init__(self, workers: int = WORKERS, max_pending: int = MAX_PENDING):
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._errors = []
+        self._lock = threading.Lock()
+        self._threads = [threading.Thread(target=self._work, daemon=True) for _ in range(workers)]
+        for thread in self._threads:
+            thread.start()
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # Do not hide the error of the program itself
+        self.close(raise_errors=exc_type is None)
+
+    def _work(self):
+        while True:
+            task = self._queue.get()
+            try:
+                if task is None:
+                    return
+                func, args = task
+                func(*args)
+            except Exception as e:
+                with self._lock:
+                    self._errors.append(e)
+            finally:
+                self._queue.task_done()
+
+    @staticmethod
+    def _imwrite(path, img, params):
+        if not cv2.imwrite(str(path), img, params or []):
+            raise IOError(f"Could not write image: {path}")
+
+    def submit(self, func, *args):
+        """Queue a write task; waits while the queue is full."""
+        if self._closed:
+            raise RuntimeError("ImageWriter is closed")
+        self._queue.put((func, args))
+
+    def imwrite(self, path, img, params=None):
+        """Queue cv2.imwrite(path, img); the image must not be modified afterwards."""
+        self.submit(self._imwrite, path, img, params)
+
+    def copy(self, src, dst):
+        """Queue shutil.copy2(src, dst)."""
+        self.submit(shutil.copy2, src, dst)
+
+    def _raise_errors(self):
+        with self._lock:
+            errors, self._errors = self._errors, []
+        if errors:
+            raise IOError(f"{len(errors)} output file(s) could not be written; first error: {errors[0]}") \
+                from errors[0]
+
+    def flush(self):
+        """Wait until every queued task is done and raise if any of them failed."""
+        self._queue.join()
+        self._raise_errors()
+
+    def close(self, raise_errors: bool = True):
+        """Finish all queued tasks and stop the threads."""
+        if self._closed:
+            return
+        self._closed = True
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        if raise_errors:
+            self._raise_errors()
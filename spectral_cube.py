@@ -0,0 +1,285 @@
+# Shared helpers for the programs that read spectral cubes taken by the MUSES9-HS hyperspectral camera.
+# A spectral cube is a 'Spectral_Cube' folder holding one image per band (image365.jpg ... image1000.jpg).
+# The cube can be copied into a temporary band-sequential array on disk (bands x height x width),
+# so that pixel tiles can be streamed from it without keeping the whole cube in memory.
+# Folders and band images are resolved through the SQLite catalog (catalog.py) instead of directory listings.
+# Spectral and spatial binning can be applied while the bands are decoded (see LOAD-TIME BINNING below),
+# so that exploratory runs never hold the full-resolution data.
+
+import hashlib
+import os
+import re
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+# ----------------- CONFIG -----------------
+FOLDER_LIST_FILE = "folder_list.txt"
+SKIP_FIRST_N_FOLDERS = 3
+
+SPECTRAL_SUBFOLDER = "Spectral_Cube"
+MASKS_SUBFOLDER = "masks"
+
+# Resolve folders and bands through the catalog (catalog.py); False lists the directories every time
+USE_CATALOG = True
+
+# Spectral image naming pattern
+IMG_RE = re.compile(r"^image(\d{3,4})\.(jpg|jpeg|png)$", re.IGNORECASE)
+
+# ----------------- LOAD-TIME BINNING -----------------
+# These settings are shared by all programs that load the cube through this file.
+# Each program may also pass its own values to iter_bands() / open_cube().
+SPECTRAL_BIN_NM = 0  # average neighbouring bands into bins of this width (e.g. 10 or 20 nm); 0 keeps every band
+BAND_SUBSET = None  # list of wavelengths to keep (e.g. [450, 550, 670, 800]); None keeps every band
+SPATIAL_BIN = 1  # average n x n blocks of pixels (e.g. 2 or 4); 1 keeps the native size
+
+
+# ----------------- HELPERS -----------------
+def read_folder_list(path: str = FOLDER_LIST_FILE, skip_n: int = SKIP_FIRST_N_FOLDERS) -> list[Path]:
+    """Read folder names from folder_list.txt, skipping the Spectralon/Dark_current/Flat_field lines."""
+    p = Path(path)
+    if not p.exists():
+        raise FileNotFoundError(f"Missing {path}")
+
+    folders = []
+    for line in p.read_text(encoding="utf-8", errors="ignore").splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        folders.append(Path(line).expanduser())
+
+    return folders[skip_n:] if len(folders) > skip_n else []
+
+
+def read_reference_folders(path: str = FOLDER_LIST_FILE) -> list[str]:
+    """Spectralon, Dark_current and Flat_field folder names (lines 1-3 of folder_list.txt; '' if missing)."""
+    if not os.path.exists(path):
+        return ["", "", ""]
+    with open(path, "r") as f1:
+        lines = [line.strip() for line in f1]
+    return (lines + ["", "", ""])[:3]
+
+
+def resolve_corrected_folder(folder: Path) -> Path:
+    """Use Corrected_<foldername> if it exists as a sibling folder; else use folder."""
+    # Checked on disk every time (one stat call), as the copy may be made or deleted by any program
+    corrected = folder.parent / f"Corrected_{folder.name}"
+    return corrected if corrected.is_dir() else folder
+
+
+def scan_spectral_images(folder: Path) -> list[tuple[int, Path]]:
+    """List the band images of a folder on disk, sorted by wavelength."""
+    spectral = Path(folder) / SPECTRAL_SUBFOLDER
+    if not spectral.is_dir():
+        return []  # no Spectral_Cube
+
+    items = []
+    for entry in spectral.iterdir():
+        if not entry.is_file():
+            continue
+        m = IMG_RE.match(entry.name)
+        if not m:
+            continue
+        items.append((int(m.group(1)), entry))
+
+    items.sort(key=lambda t: t[0])
+    return items
+
+
+def list_spectral_images(folder: Path) -> list[tuple[int, Path]]:
+    """Return the (wavelength, path) pairs of the band images of a folder, sorted by wavelength."""
+    if USE_CATALOG:
+        import catalog  # imported here, as catalog.py itself imports this file
+
+        return catalog.band_paths(folder)
+    return scan_spectral_images(folder)
+
+
+def band_extension(folder: Path) -> str | None:
+    """The most frequent extension of the band images of a folder ('jpg' or 'png'), without the dot."""
+    if USE_CATALOG:
+        import catalog
+
+        info = catalog.folder_info(folder)
+        return None if info is None else info["extension"]
+    extensions = [path.suffix.lower().lstrip(".") for _, path in scan_spectral_images(folder)]
+    return max(set(extensions), key=extensions.count) if extensions else None
+
+
+def list_products(folder: Path, kind: str) -> list[Path]:
+    """Files of one product subfolder (e.g. 'masks' or 'Indexes_out') of a folder, sorted by name."""
+    if USE_CATALOG:
+        import catalog
+
+        return catalog.list_products(folder, kind)
+    sub_dir = Path(folder) / kind
+    if not sub_dir.is_dir():
+        return []
+    return sorted(path for path in sub_dir.iterdir() if path.is_file())
+
+
+def file_checksum(path: Path) -> str:
+    """SHA-1 of the contents of a file."""
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def cube_checksum(folder: Path) -> str | None:
+    """
+    Checksum of all band images of a folder (None if there are none).
+    The catalog hashes only the images changed since the last call; without it every band image is read.
+    """
+    if USE_CATALOG:
+        import catalog
+
+        return catalog.cube_checksum(folder)
+    bands = scan_spectral_images(folder)
+    if not bands:
+        return None
+    # The same value as the catalog gives
+    return hashlib.sha1("".join(f"{wl}:{file_checksum(path)};" for wl, path in bands).encode()).hexdigest()
+
+
+def image_size(folder: Path) -> tuple[int, int] | None:
+    """(height, width) of the band images of a folder (None if there are none)."""
+    if USE_CATALOG:
+        import catalog
+
+        info = catalog.folder_info(folder)
+        return None if info is None or info["height"] is None else (info["height"], info["width"])
+    bands = scan_spectral_images(folder)
+    if not bands:
+        return None
+    img = cv2.imread(str(bands[-1][1]), cv2.IMREAD_UNCHANGED)
+    return None if img is None else img.shape[:2]
+
+
+def load_grayscale(path: Path) -> np.ndarray:
+    """
+    Always return a 2D uint8 grayscale image.
+    Handles 2D, (H,W,1), BGR, BGRA.
+    """
+    img = cv2.imread(str(path), cv2.IMREAD_UNCHANGED)
+    if img is None:
+        raise RuntimeError(f"Could not read image: {path}")
+
+    if img.ndim == 2:
+        return img.astype(np.uint8)
+
+    if img.ndim == 3:
+        ch = img.shape[2]
+        if ch == 1:
+            return img[:, :, 0].astype(np.uint8)
+        if ch == 4:
+            img = cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
+            ch = 3
+        if ch == 3:
+            return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY).astype(np.uint8)
+
+    raise ValueError(f"Unsupported image shape {img.shape} for file: {path}")
+
+
+def bin_spatial(img: np.ndarray, factor: int) -> np.ndarray:
+    """Average factor x factor blocks of pixels (the image is cropped to a multiple of factor)."""
+    if factor <= 1:
+        return img
+    h, w = img.shape[:2]
+    h, w = h - h % factor, w - w % factor
+    return cv2.resize(img[:h, :w], (w // factor, h // factor), interpolation=cv2.INTER_AREA)
+
+
+def plan_bands(waves: list[int], spectral_bin_nm: int = 0, band_subset=None) -> list[tuple[int, list[int]]]:
+    """
+    Group the wavelengths of a cube into output bands.
+    Returns a list of (output wavelength, member wavelengths); the output wavelength of a bin
+    is the rounded mean of its members.
+    """
+    if band_subset is not None:
+        wanted = set(band_subset)
+        waves = [wl for wl in waves if wl in wanted]
+    if not spectral_bin_nm:
+        return [(wl, [wl]) for wl in waves]
+
+    bins = {}
+    for wl in waves:
+        bins.setdefault(wl // spectral_bin_nm, []).append(wl)
+    return [(int(round(sum(members) / len(members))), members) for _, members in sorted(bins.items())]
+
+
+def iter_bands(folder: Path, spectral_bin_nm: int | None = None, band_subset=None, spatial_bin: int | None = None):
+    """
+    Decode the bands of <folder>/Spectral_Cube one at a time, applying the load-time binning.
+    Yields (wavelength, band) pairs, band being a 2D uint8 array.
+    Arguments left as None take the shared settings from the top of this file.
+    """
+    spectral_bin_nm = SPECTRAL_BIN_NM if spectral_bin_nm is None else spectral_bin_nm
+    band_subset = BAND_SUBSET if band_subset is None else band_subset
+    spatial_bin = SPATIAL_BIN if spatial_bin is None else spatial_bin
+
+    paths = dict(list_spectral_images(folder))
+    for out_wl, members in plan_bands(sorted(paths), spectral_bin_nm, band_subset):
+        if len(members) == 1:
+            yield out_wl, bin_spatial(load_grayscale(paths[members[0]]), spatial_bin)
+            continue
+        acc = None
+        for wl in members:
+            band = bin_spatial(load_grayscale(paths[wl]), spatial_bin).astype(np.float32)
+            acc = band if acc is None else acc + band
+        yield out_wl, np.clip(np.rint(acc / len(members)), 0, 255).astype(np.uint8)
+
+
+@contextmanager
+def open_cube(folder: Path, tmp_dir: str | None = None, spectral_bin_nm: int | None = None, band_subset=None,
+              spatial_bin: int | None = None):
+    """
+    Decode every band of <folder>/Spectral_Cube into a temporary band-sequential memmap.
+    Yields (waves, cube), where cube has shape (bands, height, width) and dtype uint8.
+    The binning arguments are passed to iter_bands(), so only the binned cube is stored.
+    Only one decoded band is held in memory at a time; the file is removed on exit.
+    """
+    spectral_bin_nm = SPECTRAL_BIN_NM if spectral_bin_nm is None else spectral_bin_nm
+    band_subset = BAND_SUBSET if band_subset is None else band_subset
+
+    items = list_spectral_images(folder)
+    plan = plan_bands([wl for wl, _ in items], spectral_bin_nm, band_subset)
+    if not plan:
+        raise FileNotFoundError(f"No image jpg/png files found in {Path(folder) / SPECTRAL_SUBFOLDER}")
+
+    bands = iter_bands(folder, spectral_bin_nm, band_subset, spatial_bin)
+    first_wl, first = next(bands)
+    height, width = first.shape
+
+    with tempfile.TemporaryDirectory(dir=tmp_dir, ignore_cleanup_errors=True) as tmp:
+        cube = np.lib.format.open_memmap(os.path.join(tmp, "cube.npy"), mode="w+", dtype=np.uint8,
+                                         shape=(len(plan), height, width))
+        cube[0] = first
+        waves = [first_wl]
+        for i, (wl, band) in enumerate(bands, start=1):
+            if band.shape != (height, width):
+                raise ValueError(f"Band {wl} of {folder} has shape {band.shape}, expected {(height, width)}")
+            cube[i] = band
+            waves.append(wl)
+        cube.flush()
+        try:
+            yield waves, cube
+        finally:
+            del cube
+
+
+def iter_tiles(cube: np.ndarray, tile_rows: int):
+    """Yield (row_start, row_stop, tile) for horizontal strips of a (bands, height, width) cube."""
+    height = cube.shape[1]
+    for r0 in range(0, height, tile_rows):
+        r1 = min(r0 + tile_rows, height)
+        yield r0, r1, np.asarray(cube[:, r0:r1, :])
+
+
+def tile_pixels(tile: np.ndarray) -> np.ndarray:
+    """Reshape a (bands, rows, width) tile into a (pixels, bands) float32 matrix."""
+    return tile.reshape(tile.shape[0], -1).T.astype(np.float32)
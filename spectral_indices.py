@@ -0,0 +1,62 @@
+# Registry of the spectral indices calculated by Indexes_auto.py and Mask_indexes.py.
+# Every index is a formula of the band images R[wavelength] (float32 arrays of the same size)
+# and an optional fixed display range (vmin, vmax) used for the heatmaps; None scales the heatmap by percentiles.
+# To add an index, add its line to INDICES; the wavelengths it needs are found automatically.
+
+from collections import defaultdict
+
+# Small epsilon to avoid division by zero
+EPS = 1e-6
+
+INDICES = {
+    # ARI1 = 1 / R550 - 1 / R700
+    'ARI1': (lambda R: 1.0 / (R[550] + EPS) - 1.0 / (R[700] + EPS), None),
+    # ARI2 = R800 * (1/R550 - 1/R700)
+    'ARI2': (lambda R: R[800] * (1.0 / (R[550] + EPS) - 1.0 / (R[700] + EPS)), None),
+    # CARI = R720 / R510 - 1
+    'CARI': (lambda R: (R[720] / (R[510] + EPS)) - 1.0, None),
+    # CRI1 = 1/R510 - 1/R550
+    'CRI1': (lambda R: 1.0 / (R[510] + EPS) - 1.0 / (R[550] + EPS), None),
+    # CRI2 = 1/R510 - 1/R700
+    'CRI2': (lambda R: 1.0 / (R[510] + EPS) - 1.0 / (R[700] + EPS), None),
+    # CI_rededge = R840 / R720 - 1
+    'CI_rededge': (lambda R: (R[840] / (R[720] + EPS)) - 1.0, None),
+    # GM1 = R750 / R550
+    'GM1': (lambda R: R[750] / (R[550] + EPS), None),
+    # GM2 = R750 / R700
+    'GM2': (lambda R: R[750] / (R[700] + EPS), None),
+    # NPCI = (R680 - R430) / (R680 + R430)  --> normalized difference, fix scale [-1, 1]
+    'NPCI': (lambda R: (R[680] - R[430]) / (R[680] + R[430] + EPS), (-1.0, 1.0)),
+    # NPQI = (R420 - R440) / (R420 + R440)  --> normalized difference, fix scale [-1, 1]
+    'NPQI': (lambda R: (R[420] - R[440]) / (R[420] + R[440] + EPS), (-1.0, 1.0)),
+    # NDVI = (R800 - R670) / (R800 + R670)  --> normalized difference, fix scale [-1, 1]
+    'NDVI': (lambda R: (R[800] - R[670]) / (R[800] + R[670] + EPS), (-1.0, 1.0)),
+    # PRI = (R530 - R570) / (R530 + R570)  --> normalized difference, fix scale [-1, 1]
+    'PRI': (lambda R: (R[530] - R[570]) / (R[530] + R[570] + EPS), (-1.0, 1.0)),
+    # PSRI = (R680 - R500) / R750
+    'PSRI': (lambda R: (R[680] - R[500]) / (R[750] + EPS), None),
+    # RENDVI = (R750 - R710) / (R750 + R710)  --> normalized difference, fix scale [-1, 1]
+    'RENDVI': (lambda R: (R[750] - R[710]) / (R[750] + R[710] + EPS), (-1.0, 1.0)),
+    # SRPI = R430 / R680
+    'SRPI': (lambda R: R[430] / (R[680] + EPS), None),
+    # SIPI = (R800 - R450) / (R800 - R680)
+    'SIPI': (lambda R: (R[800] - R[450]) / (R[800] - R[680] + EPS), None),
+    # VREI1 = R740 / R720
+    'VREI1': (lambda R: R[740] / (R[720] + EPS), None),
+    # VREI2 = (R730 - R750) / (R720 + R730)
+    'VREI2': (lambda R: (R[730] - R[750]) / (R[720] + R[730] + EPS), None),
+    # WBI = R970 / R900
+    'WBI': (lambda R: R[970] / (R[900] + EPS), None),
+}
+
+
+def required_wavelengths(indices: dict = INDICES) -> list[int]:
+    """All wavelengths used by the formulas, found by evaluating them on a dict that records the bands asked for."""
+    bands = defaultdict(lambda: 1.0)
+    for formula, _ in indices.values():
+        formula(bands)
+    return sorted(bands)
+
+
+# List of all wavelengths needed for the indices
+REQUIRED_WAVELENGTHS = required_wavelengths()
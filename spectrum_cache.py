@@ -0,0 +1,105 @@
+# Disk cache of the spectra of ROIs and masks, shared by HYPER-S.py and Mask_spectra.py
+# (and the programs that call Mask_spectra.py: Watch_folder.py, work_queue.py).
+# A spectrum is stored under a key made of the checksum of the cube (spectral_cube.cube_checksum),
+# the ROI rectangle or the checksum of the mask file, and the parameters of the calculation
+# (e.g. sd_number and the background spectrum). When any of them changes, the key changes,
+# so only new or changed regions are calculated again and the others are read from the cache.
+# The cache is the folder CACHE_DIR in the common folder, one small JSON file per spectrum.
+# When it grows beyond MAX_CACHE_MB, the least recently used spectra are deleted.
+#
+# Usage:
+#   key = make_key('mask', cube_checksum(folder), file_checksum(mask_file), parameters)
+#   spectrum = get(key)
+#   if spectrum is None:
+#       spectrum = calculate()
+#       put(key, spectrum)
+
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+
+from spectral_cube import cube_checksum, file_checksum  # used in the keys (see Usage above)
+
+# ----------------- CONFIG -----------------
+USE_CACHE = True  # False calculates every spectrum again
+CACHE_DIR = "spectrum_cache"
+MAX_CACHE_MB = 200  # the least recently used spectra are deleted above this size
+CACHE_VERSION = 1  # change when the calculation of the spectra changes, so the old entries are not used
+
+_written = 0  # bytes written since the last eviction
+
+
+# ----------------- HELPERS -----------------
+def make_key(*parts) -> str | None:
+    """A cache key from JSON-serializable parts; None if any part is unknown (the result is not cached)."""
+    if any(part is None for part in parts):
+        return None
+    return hashlib.sha1(json.dumps([CACHE_VERSION, *parts]).encode()).hexdigest()
+
+
+def _entry_path(key: str) -> Path:
+    return Path(CACHE_DIR) / key[:2] / (key + ".json")
+
+
+def get(key: str | None):
+    """The cached value, or None if it is not in the cache."""
+    if not USE_CACHE or key is None:
+        return None
+    path = _entry_path(key)
+    try:
+        with open(path, "r") as f:
+            value = json.load(f)
+    except (OSError, ValueError):
+        return None
+    os.utime(path)  # the modification time marks the last use
+    return value
+
+
+def put(key: str | None, value) -> None:
+    """Store a JSON-serializable value; the file is renamed into place, so readers never see half of it."""
+    global _written
+    if not USE_CACHE or key is None:
+        return
+    path = _entry_path(key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "w") as f:
+        json.dump(value, f)
+    os.replace(tmp, path)
+    _written += path.stat().st_size
+    if _written > MAX_CACHE_MB * 1024 * 1024 // 10:
+        evict()
+
+
+def evict(max_mb: float = MAX_CACHE_MB) -> int:
+    """Delete the least recently used entries until the cache fits into max_mb. Returns the number deleted."""
+    global _written
+    _written = 0
+    if not os.path.isdir(CACHE_DIR):
+        return 0
+    entries = []
+    for sub in os.scandir(CACHE_DIR):
+        if not sub.is_dir():
+            continue
+        for entry in os.scandir(sub.path):
+            st = entry.stat()
+            if entry.name.endswith(".tmp") and time.time() - st.st_mtime > 3600:
+                os.remove(entry.path)  # left by a program that was stopped while writing
+            elif entry.name.endswith(".json"):
+                entries.append((st.st_mtime, st.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    limit = max_mb * 1024 * 1024
+    deleted = 0
+    for _, size, path in sorted(entries):
+        if total <= limit:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue  # deleted by another program
+        total -= size
+        deleted += 1
+    return deleted
@@ -0,0 +1,299 @@
+# SQLite task queue for running the processing of many folders by several workers.
+# The queue file ('work_queue.sqlite') lies in the common folder; any number of workers, on this computer
+# or on other computers that see the common folder on a shared disk, take folders from it.
+# A worker leases a task for LEASE_SECONDS and renews the lease (heartbeat) while the task runs.
+# If a worker stops, its task is taken by another worker after the lease expires.
+# A failed task is retried up to MAX_ATTEMPTS times; a task whose worker stops on the last attempt fails.
+# Every task writes its results to a temporary folder next to the final one and renames it when finished,
+# so there are no half-written outputs, and a task done twice gives the same single output.
+#
+# Tasks (the folder names are taken from 'folder_list.txt', the first three lines are skipped):
+#   correction  -- as image_correction.py, using 'spectralon_spectrum.csv' saved by its interactive run
+#   indexes     -- as Indexes_auto.py, to <Corrected_folder>/Indexes_out
+#   pca         -- as HS-PCA.py, to <Corrected_folder>/PCA-Out
+#   extraction  -- as Mask_spectra.py, to <Corrected_folder>/spectral_data.xlsx
+# The other tasks of a folder wait for its correction task. The 'Corrected_' folders are used when they exist.
+#
+# Usage (from the common folder):
+#   python work_queue.py add correction indexes pca extraction   -- queue the tasks for all folders
+#   python work_queue.py work                                    -- run a worker until the queue is empty
+#   python work_queue.py status                                  -- show the queue
+#   python work_queue.py retry                                   -- queue the failed tasks again
+
+import glob
+import os
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from pathlib import Path
+
+import catalog
+from image_writer import ImageWriter
+from spectral_cube import read_folder_list, read_reference_folders, resolve_corrected_folder, band_extension
+
+# ----------------- CONFIG -----------------
+QUEUE_FILE = 'work_queue.sqlite'
+LEASE_SECONDS = 120  # a task of a silent worker is given to another worker after this time
+HEARTBEAT_SECONDS = 20  # how often a running task renews its lease
+MAX_ATTEMPTS = 3
+IDLE_SECONDS = 5  # how long a worker waits when other workers still run tasks
+
+TASKS = ['correction', 'indexes', 'pca', 'extraction']  # in the order they are done for a folder
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    folder TEXT NOT NULL,
+    task TEXT NOT NULL,
+    stage INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_until REAL,
+    error TEXT,
+    finished_at REAL,
+    UNIQUE (folder, task)
+);
+"""
+
+
+# ----------------- QUEUE -----------------
+def connect(path: str = QUEUE_FILE) -> sqlite3.Connection:
+    # Rollback journal (not WAL), as WAL does not work on network file systems
+    conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def add_tasks(conn: sqlite3.Connection, folders: list[str], tasks: list[str]) -> int:
+    """Queue the tasks for the folders; a task that is already queued is queued again only if it failed."""
+    added = 0
+    for folder in folders:
+        for task in tasks:
+            cur = conn.execute("INSERT OR IGNORE INTO tasks (folder, task, stage) VALUES (?, ?, ?)",
+                               (folder, task, TASKS.index(task)))
+            added += cur.rowcount
+    return added
+
+
+def claim(conn: sqlite3.Connection, worker: str) -> sqlite3.Row | None:
+    """Lease the next runnable task to the worker (pending, or running with an expired lease)."""
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # A task whose worker stopped on its last attempt fails, so the tasks waiting for it are not blocked
+        conn.execute("UPDATE tasks SET status = 'failed', error = COALESCE(error, 'The worker stopped') "
+                     "WHERE status = 'running' AND lease_until < ? AND attempts >= ?", (now, MAX_ATTEMPTS))
+        row = conn.execute("""
+            SELECT * FROM tasks t
+            WHERE (t.status = 'pending' OR (t.status = 'running' AND t.lease_until < ?))
+              AND t.attempts < ?
+              AND NOT EXISTS (SELECT 1 FROM tasks c
+                              WHERE c.folder = t.folder AND c.stage < t.stage AND c.task = 'correction'
+                                AND c.status IN ('pending', 'running'))
+            ORDER BY t.stage, t.id LIMIT 1""", (now, MAX_ATTEMPTS)).fetchone()
+        if row is not None:
+            conn.execute("UPDATE tasks SET status = 'running', worker = ?, lease_until = ?, attempts = attempts + 1 "
+                         "WHERE id = ?", (worker, now + LEASE_SECONDS, row["id"]))
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return row
+
+
+def finish(conn: sqlite3.Connection, task_id: int, worker: str, error: str | None = None) -> None:
+    """Mark a task done or failed; nothing is changed if the lease was taken by another worker."""
+    if error is None:
+        conn.execute("UPDATE tasks SET status = 'done', error = NULL, finished_at = ? WHERE id = ? AND worker = ?",
+                     (time.time(), task_id, worker))
+    else:
+        conn.execute("UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                     "error = ? WHERE id = ? AND worker = ?", (MAX_ATTEMPTS, error, task_id, worker))
+
+
+def has_active_tasks(conn: sqlite3.Connection) -> bool:
+    """Whether tasks are left to run or still running (the stopped ones are failed by claim)."""
+    row = conn.execute("SELECT COUNT(*) FROM tasks WHERE status = 'running' OR status = 'pending'").fetchone()
+    return row[0] > 0
+
+
+class Heartbeat(threading.Thread):
+    """Renews the lease of a running task until stopped."""
+
+    def __init__(self, task_id: int, worker: str):
+        super().__init__(daemon=True)
+        self.task_id = task_id
+        self.worker = worker
+        self.stopped = threading.Event()
+
+    def run(self):
+        conn = connect()
+        while not self.stopped.wait(HEARTBEAT_SECONDS):
+            conn.execute("UPDATE tasks SET lease_until = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                         (time.time() + LEASE_SECONDS, self.task_id, self.worker))
+        conn.close()
+
+
+# ----------------- OUTPUTS -----------------
+def temporary_output(final: Path, worker: str) -> Path:
+    """A fresh temporary path next to the final output; stale ones of stopped workers are removed."""
+    for stale in glob.glob(glob.escape(str(final)) + '.tmp-*'):
+        if time.time() - os.path.getmtime(stale) > 2 * LEASE_SECONDS:
+            shutil.rmtree(stale, ignore_errors=True) if os.path.isdir(stale) else os.remove(stale)
+    tmp = final.parent / f'{final.name}.tmp-{worker}'
+    if tmp.is_dir():
+        shutil.rmtree(tmp)
+    elif tmp.exists():
+        tmp.unlink()
+    return tmp
+
+
+def publish(tmp: Path, final: Path, worker: str) -> None:
+    """Replace the final output by the finished temporary one."""
+    if tmp.is_dir() and final.exists():
+        old = final.parent / f'{final.name}.old-{worker}'
+        os.replace(final, old)
+        os.replace(tmp, final)
+        shutil.rmtree(old, ignore_errors=True)
+    else:
+        os.replace(tmp, final)
+
+
+# ----------------- TASKS -----------------
+def run_correction(folder: str, worker: str) -> None:
+    import image_correction
+
+    _, dark_folder, flat_folder = read_reference_folders()
+    if not os.path.exists(image_correction.SPECTRALON_SPECTRUM_FILE):
+        raise FileNotFoundError(f'{image_correction.SPECTRALON_SPECTRUM_FILE} not found; '
+                                f'run image_correction.py once to measure the spectralon')
+    spectrum = image_correction.load_spectralon_spectrum()
+
+    # A new Corrected_ folder is built whole next to the final one, so that a failed correction does not leave
+    # an empty Corrected_ folder that the other programs would take instead of the raw one
+    corrected = Path('Corrected_' + folder)
+    final = corrected / 'Spectral_Cube' if corrected.is_dir() else corrected
+    tmp = temporary_output(final, worker)
+    tmp_cube = tmp if final != corrected else tmp / 'Spectral_Cube'
+    tmp_cube.mkdir(parents=True)
+    try:
+        with ImageWriter() as writer:
+            image_correction.correct_folder(folder + '/Spectral_Cube/', str(tmp_cube) + '/',
+                                            dark_folder + '/Spectral_Cube/', flat_folder + '/Spectral_Cube/', spectrum,
+                                            '.' + band_extension(Path(folder)), writer, show=False)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    publish(tmp, final, worker)
+    catalog.update_folder(catalog.default_connection(), corrected, force=True)
+
+
+def run_indexes(folder: str, worker: str) -> None:
+    import Indexes_auto
+
+    final = resolve_corrected_folder(Path(folder)) / 'Indexes_out'
+    tmp = temporary_output(final, worker)
+    with ImageWriter() as writer:
+        Indexes_auto.compute_indexes(folder, writer, index_out_folder=str(tmp))
+    publish(tmp, final, worker)
+
+
+def run_pca(folder: str, worker: str) -> None:
+    cube_folder = resolve_corrected_folder(Path(folder))
+    final = cube_folder / 'PCA-Out'
+    tmp = temporary_output(final, worker)
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'HS-PCA.py')
+    subprocess.run([sys.executable, script, str(cube_folder), str(tmp)], check=True)
+    publish(tmp, final, worker)
+
+
+def run_extraction(folder: str, worker: str) -> None:
+    import Mask_spectra
+
+    folder_path = resolve_corrected_folder(Path(folder))
+    rows = Mask_spectra.folder_mask_rows(folder, folder_path)
+    if not rows:
+        return  # no masks
+    final = folder_path / Mask_spectra.OUTPUT_XLSX
+    tmp = temporary_output(final, worker)
+    Mask_spectra.rows_to_table(rows).to_excel(tmp, index=False, engine='openpyxl')
+    publish(tmp, final, worker)
+
+
+TASK_FUNCTIONS = {
+    'correction': run_correction,
+    'indexes': run_indexes,
+    'pca': run_pca,
+    'extraction': run_extraction,
+}
+
+
+# ----------------- WORKER -----------------
+def work(worker: str | None = None) -> None:
+    """Take and run tasks until none are left."""
+    worker = worker or f'{socket.gethostname()}-{os.getpid()}'
+    conn = connect()
+    print(f'Worker {worker} started')
+    while True:
+        task = claim(conn, worker)
+        if task is None:
+            if not has_active_tasks(conn):
+                break
+            time.sleep(IDLE_SECONDS)  # other workers still run tasks that may fail or be released
+            continue
+
+        print(f'{worker}: {task["task"]} of {task["folder"]} (attempt {task["attempts"] + 1})')
+        heartbeat = Heartbeat(task['id'], worker)
+        heartbeat.start()
+        try:
+            TASK_FUNCTIONS[task['task']](task['folder'], worker)
+            error = None
+        except Exception:
+            error = traceback.format_exc()
+            print(f'{worker}: {task["task"]} of {task["folder"]} failed\n{error}')
+        finally:
+            heartbeat.stopped.set()
+            heartbeat.join()
+        catalog.invalidate(task['folder'])
+        finish(conn, task['id'], worker, error)
+    print(f'Worker {worker} finished: the queue is empty')
+
+
+def print_status(conn: sqlite3.Connection) -> None:
+    for row in conn.execute("SELECT task, status, COUNT(*) AS n FROM tasks GROUP BY stage, task, status "
+                            "ORDER BY stage, status"):
+        print(f'{row["task"]:<12}{row["status"]:<10}{row["n"]}')
+    for row in conn.execute("SELECT folder, task, error FROM tasks WHERE status = 'failed'"):
+        print(f'\nFailed: {row["task"]} of {row["folder"]}\n{row["error"]}')
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else 'work'
+    conn = connect()
+    if command == 'add':
+        tasks = sys.argv[2:] or TASKS
+        unknown = [t for t in tasks if t not in TASKS]
+        if unknown:
+            raise SystemExit(f'Unknown tasks: {unknown}. Known tasks: {TASKS}')
+        folders = [str(f) for f in read_folder_list()]
+        print(f'{add_tasks(conn, folders, tasks)} tasks queued')
+    elif command == 'work':
+        work()
+    elif command == 'status':
+        print_status(conn)
+    elif command == 'retry':
+        cur = conn.execute("UPDATE tasks SET status = 'pending', attempts = 0 WHERE status = 'failed'")
+        print(f'{cur.rowcount} failed tasks queued again')
+    else:
+        raise SystemExit('Usage: python work_queue.py [add <task> ... | work | status | retry]')
+
+
+if __name__ == '__main__':
+    main()